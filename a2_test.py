@@ -1,4 +1,6 @@
 import os
+import time
+from queue import Queue
 
 import pytest
 from hypothesis import given
@@ -10,7 +12,13 @@ from tree_data import FileSystemTree
 # This should be the path to the "B" folder in the sample data.
 # You may need to modify this, depending on where you downloaded and
 # extracted the files.
-from tree_data import AbstractTree
+from tree_data import AbstractTree, slice_layout, squarify_layout, \
+    rects_overlap
+from compact_tree import CompactTree, save_compact, load_compact
+from watcher import TreeWatcher
+from parallel_layout import ParallelLayout
+from scanner import scan_file_system, scan_with_snapshot, scan_lazy, \
+    scan_streaming, ScanRules, SizeSampler, refine_estimates
 
 EXAMPLE_PATH = os.path.join('example-data', 'B')
 
@@ -111,6 +119,648 @@ def test_example_data() -> None:
     assert rect_f4 == (0, 750, 800, 250)
 
 
+def test_scan_file_system_matches_constructor() -> None:
+    expected = FileSystemTree(EXAMPLE_PATH)
+    tree = scan_file_system(EXAMPLE_PATH, 4)
+
+    assert _same_tree(expected, tree)
+    for subtree in tree._subtrees:
+        assert subtree._parent_tree is tree
+
+
+def test_scan_with_snapshot_picks_up_changes(tmp_path) -> None:
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'sub' / 'a.txt').write_bytes(b'x' * 10)
+    (root / 'b.txt').write_bytes(b'x' * 5)
+    snapshot = str(tmp_path / 'scan.json')
+
+    first = scan_with_snapshot(str(root), snapshot)
+    assert first.data_size == 15
+    assert os.path.exists(snapshot)
+
+    (root / 'sub' / 'c.txt').write_bytes(b'x' * 20)
+    second = scan_with_snapshot(str(root), snapshot)
+    assert second.data_size == 35
+    assert _same_tree(FileSystemTree(str(root)), second)
+
+
+def test_scan_lazy_expands_visible_folders() -> None:
+    tree = scan_lazy(EXAMPLE_PATH)
+    assert tree.data_size == 40
+    assert len(tree._subtrees) == 2
+
+    folder = [sub for sub in tree._subtrees if sub._root == 'A'][0]
+    assert folder._subtrees == []
+    assert folder.data_size == 30
+
+    assert tree.expand_visible((0, 0, 800, 1000))
+    _sort_subtrees(tree)
+    expected = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(expected)
+    assert _same_tree(expected, tree)
+    assert not tree.expand_visible((0, 0, 800, 1000))
+
+
+def test_scan_streaming_fills_in_tree() -> None:
+    updates = Queue()
+    tree = scan_streaming(EXAMPLE_PATH, updates, 2)
+    assert tree._root == 'B'
+
+    # One update per folder: B and A.
+    for _ in range(2):
+        updates.get(timeout=5)()
+
+    assert tree.data_size == 40
+    _sort_subtrees(tree)
+    expected = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(expected)
+    assert _same_tree(expected, tree)
+
+
+def test_scan_file_system_coalesces_small_items(tmp_path) -> None:
+    (tmp_path / 'big.bin').write_bytes(b'x' * 1000)
+    for i in range(5):
+        (tmp_path / 'small{}.txt'.format(i)).write_bytes(b'x' * (i + 1))
+
+    tree = scan_file_system(str(tmp_path), min_size=100)
+    assert tree.data_size == 1015
+    assert len(tree._subtrees) == 2
+    assert tree._subtrees[0]._root == 'big.bin'
+    other = tree._subtrees[1]
+    assert other._root == '<5 small items>'
+    assert other.data_size == 15
+
+    assert len(other.split()) == 5
+    assert len(tree._subtrees) == 6
+    assert tree.data_size == 1015
+
+    tree = scan_file_system(str(tmp_path), min_size=100)
+    assert tree.expand_visible((0, 0, 1015, 100))
+    assert len(tree) == 7 and tree.data_size == 1015
+
+
+def test_split_follows_the_scan_rules_and_thresholds(tmp_path) -> None:
+    (tmp_path / 'big.bin').write_bytes(b'x' * 5000)
+    (tmp_path / '.git').mkdir()
+    for i in range(30):
+        (tmp_path / '.git' / 'obj{}'.format(i)).write_bytes(b'x' * 1000)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a.txt').write_bytes(b'x' * 10)
+    (tmp_path / 'sub' / 'b.txt').write_bytes(b'x' * 20)
+    (tmp_path / 'c.txt').write_bytes(b'x' * 5)
+
+    tree = scan_file_system(str(tmp_path), min_size=1000,
+                            rules=ScanRules(['.git/']))
+    assert tree.data_size == 5035
+    assert tree.expand_visible((0, 0, 100000, 700))
+    assert tree.data_size == 5035
+    _sort_subtrees(tree)
+    git, _, _, sub = tree._subtrees
+    assert git._root == '.git' and git._subtrees == []
+    assert [subtree._root for subtree in sub._subtrees] == \
+        ['<2 small items>']
+
+
+def test_compact_tree_matches_tree() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    compact = CompactTree(tree)
+
+    assert len(compact) == len(tree) == 6
+    assert compact.generate_treemap((0, 0, 800, 1000)) == \
+        tree.generate_treemap((0, 0, 800, 1000))
+    assert [compact.path(i) for i in compact.leaves()] == \
+        [leaf.path() for leaf in tree.leaves()]
+
+    leaf = compact.coordinate_to_tree((450, 10), (0, 0, 800, 1000))
+    assert leaf.path() == os.path.join('B', 'A', 'f2.txt') + ' (5)'
+    compact.mouse_right((450, 10), (0, 0, 800, 1000))
+    assert compact._sizes[0] == 35
+    assert len(compact) == 5
+
+
+def test_compact_layout_arrays_match_layout() -> None:
+    pytest.importorskip('numpy')
+    compact = CompactTree(FileSystemTree(EXAMPLE_PATH))
+    compact.delete_node(compact.leaves()[1])
+
+    for rect in [(0, 0, 800, 1000), (10, 20, 301, 7), (0, 0, 0, 0)]:
+        rects, colours, leaves = compact.layout_arrays(rect)
+        assert list(zip(map(tuple, rects.tolist()), leaves.tolist())) == \
+            compact._layout(rect)
+        assert [tuple(colour) for colour in colours.tolist()] == \
+            [compact.colour(index) for index in leaves.tolist()]
+
+
+def test_compact_snapshot_round_trip(tmp_path) -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    snapshot = str(tmp_path / 'tree.tmap')
+    save_compact(tree, snapshot)
+
+    loaded = load_compact(snapshot)
+    assert len(loaded) == len(tree)
+    assert loaded.get_separator() == os.path.sep
+    assert loaded.generate_treemap((0, 0, 800, 1000)) == \
+        tree.generate_treemap((0, 0, 800, 1000))
+
+    # Changes stay in memory.
+    loaded.delete_item('f4.txt')
+    assert loaded._sizes[0] == 30
+    assert load_compact(snapshot)._sizes[0] == 40
+
+
+def test_parallel_layout_matches_compact_tree() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    layout = ParallelLayout(tree, workers=2)
+    layout._tasks = 2
+    try:
+        assert layout.generate_treemap((0, 0, 800, 1000)) == \
+            tree.generate_treemap((0, 0, 800, 1000))
+
+        # The workers see deletions made through the layout's tree.
+        layout.tree.delete_node(layout.tree.leaves()[0])
+        assert layout.generate_treemap((0, 0, 800, 1000), 2) == \
+            layout.tree.generate_treemap((0, 0, 800, 1000), 2)
+    finally:
+        layout.close()
+
+
+def test_tree_watcher_applies_changes(tmp_path) -> None:
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a.txt').write_bytes(b'x' * 10)
+    (tmp_path / 'b.txt').write_bytes(b'x' * 5)
+    tree = scan_file_system(str(tmp_path))
+    updates = Queue()
+    watcher = TreeWatcher(tree, str(tmp_path), updates, interval=0.1)
+    watcher.start()
+    time.sleep(0.5)
+
+    try:
+        (tmp_path / 'sub' / 'c.txt').write_bytes(b'x' * 20)
+        os.remove(str(tmp_path / 'b.txt'))
+        deadline = time.monotonic() + 5
+        while tree.data_size != 30 and time.monotonic() < deadline:
+            if not updates.empty():
+                updates.get()()
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+
+    assert tree.data_size == 30
+    assert [subtree._root for subtree in tree._subtrees] == ['sub']
+
+
+def test_tree_watcher_follows_scan_rules(tmp_path) -> None:
+    (tmp_path / 'a.txt').write_bytes(b'x' * 10)
+    rules = ScanRules(['*.log'])
+    tree = scan_file_system(str(tmp_path), rules=rules)
+    updates = Queue()
+    watcher = TreeWatcher(tree, str(tmp_path), updates, interval=0.1,
+                          rules=rules)
+    watcher.start()
+    time.sleep(0.5)
+
+    try:
+        (tmp_path / 'c.log').write_bytes(b'x' * 100)
+        (tmp_path / 'd.txt').write_bytes(b'x' * 5)
+        deadline = time.monotonic() + 5
+        while tree.data_size != 15 and time.monotonic() < deadline:
+            if not updates.empty():
+                updates.get()()
+            time.sleep(0.01)
+        time.sleep(0.3)
+        while not updates.empty():
+            updates.get()()
+    finally:
+        watcher.stop()
+
+    assert tree.data_size == 15
+    assert sorted(sub._root for sub in tree._subtrees) == ['a.txt', 'd.txt']
+
+
+def test_scan_rules_prune_before_listing(tmp_path) -> None:
+    (tmp_path / '.git' / 'objects').mkdir(parents=True)
+    (tmp_path / '.git' / 'objects' / 'pack').write_bytes(b'x' * 100)
+    (tmp_path / 'src' / 'deep').mkdir(parents=True)
+    (tmp_path / 'src' / 'deep' / 'a.py').write_bytes(b'x' * 7)
+    (tmp_path / 'src' / 'main.py').write_bytes(b'x' * 3)
+    (tmp_path / 'debug.log').write_bytes(b'x' * 50)
+    (tmp_path / 'keep.log').write_bytes(b'x' * 5)
+
+    rules = ScanRules(['.git/', '*.log', '!keep.log'], max_depth=1)
+    tree = scan_file_system(str(tmp_path), rules=rules)
+    _sort_subtrees(tree)
+    assert [sub._root for sub in tree._subtrees] == ['.git', 'keep.log',
+                                                     'src']
+    git, _, src = tree._subtrees
+    assert git._subtrees == [] and git.data_size == 0
+    assert [sub._root for sub in src._subtrees] == ['deep', 'main.py']
+    assert src._subtrees[0]._subtrees == []
+    assert tree.data_size == 8
+
+    rules = ScanRules(['.git/'], size_pruned=True)
+    tree = scan_file_system(str(tmp_path), rules=rules)
+    assert tree.data_size == 165
+
+
+def test_sampled_scan_estimates_and_refines(tmp_path) -> None:
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a.txt').write_bytes(b'x' * 3)
+    for i in range(60):
+        (tmp_path / 'f{}'.format(i)).write_bytes(b'x' * (10 + i % 7))
+    exact = FileSystemTree(str(tmp_path)).data_size
+
+    tree = scan_file_system(str(tmp_path),
+                            sampler=SizeSampler(50, 20, seed=148))
+    assert len(tree._subtrees) == 2
+    estimate = tree._subtrees[-1]
+    assert estimate._root == '<~60 files>'
+    assert estimate.is_estimate()
+    assert abs(estimate.data_size + 3 - exact) <= estimate._error
+
+    updates = Queue()
+    refine_estimates(tree, updates).join()
+    updates.get_nowait()()
+    assert not estimate.is_estimate()
+    assert tree.data_size == exact
+
+
+def test_split_leaves_the_estimated_files_to_their_leaf(tmp_path) -> None:
+    for i in range(80):
+        (tmp_path / 'f{}'.format(i)).write_bytes(b'x' * 100)
+    for name in ['s1', 's2']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'a').write_bytes(b'x')
+
+    tree = scan_file_system(str(tmp_path), min_size=100,
+                            sampler=SizeSampler(50, 20, seed=148))
+    assert tree.data_size == 8002
+    coalesced, estimate = tree._subtrees
+    assert len(coalesced.split()) == 2
+    assert tree.data_size == 8002
+    assert len(estimate.split()) == 80
+    assert tree.data_size == 8002 and len(tree) == 85
+
+
+def test_refined_estimates_follow_scan_rules(tmp_path) -> None:
+    for i in range(60):
+        (tmp_path / 'f{}.log'.format(i)).write_bytes(b'x' * 1000)
+        (tmp_path / 'f{}.txt'.format(i)).write_bytes(b'x' * 10)
+
+    rules = ScanRules(['*.log'])
+    tree = scan_file_system(str(tmp_path), rules=rules,
+                            sampler=SizeSampler(50, 20, seed=148))
+    assert tree.data_size == 600
+
+    updates = Queue()
+    refine_estimates(tree, updates, str(tmp_path), rules).join()
+    updates.get_nowait()()
+    assert tree.data_size == 600
+
+
+def test_slice_layout_fills_rect() -> None:
+    assert slice_layout((10, 20, 100, 40), [30, 0, 10, 0], 40) == [
+        (10, 20, 75, 40), (85, 20, 0, 40), (85, 20, 25, 40), (110, 20, 0, 40)]
+    assert slice_layout((0, 0, 10, 10), [1, 1, 1], 3) == [
+        (0, 0, 10, 3), (0, 3, 10, 3), (0, 6, 10, 4)]
+
+
+def test_generate_treemap_culls_small_subtrees() -> None:
+    folder = FileSystemTree(None, 'a', [FileSystemTree(None, 'x', [], 1),
+                                        FileSystemTree(None, 'y', [], 1)])
+    tiny = FileSystemTree(None, 'd', [], 1)
+    big = FileSystemTree(None, 'b', [], 6)
+    tree = FileSystemTree(None, 'r', [folder, tiny, big])
+
+    assert [r for r, _ in tree.generate_treemap((0, 0, 7, 4))] == \
+        [(0, 0, 1, 2), (0, 2, 1, 2), (1, 0, 0, 4), (1, 0, 6, 4)]
+    assert tree.generate_treemap((0, 0, 7, 4), 2) == \
+        [((0, 0, 1, 4), folder.colour), ((1, 0, 6, 4), big.colour)]
+    assert CompactTree(tree).generate_treemap((0, 0, 7, 4), 2) == \
+        tree.generate_treemap((0, 0, 7, 4), 2)
+
+
+def test_generate_treemap_reuses_unchanged_layouts() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    folder = tree._subtrees[0]
+    rect = (0, 0, 800, 1000)
+
+    first = tree.generate_treemap(rect)
+    chunks = folder._layout_cache[3]
+    assert tree.generate_treemap(rect) == first
+    assert folder._layout_cache[3] is chunks
+
+    leaf = folder._subtrees[0]
+    size = leaf.increase_decrease(True)
+    leaf.increase_decrease_parent(size, True)
+    changed = tree.generate_treemap(rect)
+    assert folder._layout_cache[3] is not chunks
+
+    tree._layout_cache = folder._layout_cache = None
+    assert tree.generate_treemap(rect) == changed != first
+
+
+def test_iter_treemap_streams_generate_treemap() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    rect = (0, 0, 800, 1000)
+
+    triples = list(tree.iter_treemap(rect))
+    assert [(r, colour) for r, colour, _ in triples] == \
+        tree.generate_treemap(rect)
+    assert [leaf for _, _, leaf in triples] == tree.leaves()
+    assert list(tree.iter_treemap(rect)) == triples
+
+    fresh = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(fresh)
+    assert [r for r, _, _ in fresh.iter_treemap(rect, cache=False)] == \
+        [r for r, _, _ in triples]
+    assert fresh._layout_cache is None
+
+    r, _, leaf = triples[len(triples) // 2]
+    assert tree.coordinate_to_tree((r[0], r[1]), rect) is leaf
+
+    compact = CompactTree(tree)
+    assert [(r, colour) for r, colour, _ in compact.iter_treemap(rect, 2)] \
+        == tree.generate_treemap(rect, 2)
+
+
+def test_generate_treemap_clips_to_viewport() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    rect, clip = (-300, -200, 1600, 2000), (0, 0, 400, 300)
+
+    expected = [(r, colour) for r, colour in tree.generate_treemap(rect, 2)
+                if rects_overlap(r, clip)]
+    assert tree.generate_treemap(rect, 2, clip) == expected
+    assert CompactTree(tree).generate_treemap(rect, 2, clip) == expected
+    assert CompactTree(tree).generate_treemap_lod(
+        rect, 2, clip, seconds=0) == (expected, None)
+    assert tree.generate_treemap(rect, 2, (-400, 0, 100, 300)) == []
+
+
+def test_clipped_and_uncached_layouts_drop_empty_culled_rects() -> None:
+    a = FileSystemTree(None, 'a', [], 1)
+    folder = FileSystemTree(None, 'folder', [
+        FileSystemTree(None, 'x', [], 1), FileSystemTree(None, 'y', [], 1)])
+    b = FileSystemTree(None, 'b', [], 1000)
+    tree = FileSystemTree(None, 'r', [a, folder, b])
+    rect = (0, 0, 100, 10)
+
+    expected = tree.generate_treemap(rect, 2)
+    assert all(r[2] > 0 and r[3] > 0 for r, _ in expected)
+    assert [(r, colour) for r, colour, _
+            in tree.iter_treemap(rect, 2, cache=False)] == expected
+    assert tree.generate_treemap(rect, 2, rect) == expected
+    assert not rects_overlap((5, 0, 0, 10), rect)
+
+    rect, clip = (18, -37, 211, 279), (0, 0, 100, 100)
+    tree = FileSystemTree(EXAMPLE_PATH)
+    for min_side in [1, 5]:
+        expected = [(r, colour) for r, colour
+                    in tree.generate_treemap(rect, min_side)
+                    if rects_overlap(r, clip)]
+        assert tree.generate_treemap(rect, min_side, clip) == expected
+
+
+def test_generate_treemap_lod_refines_to_full_layout() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    rect = (0, 0, 800, 1000)
+    expected = tree.generate_treemap(rect)
+    tree._layout_cache = None
+
+    coarse, token = tree.generate_treemap_lod(rect, max_depth=1)
+    assert coarse == [(r, subtree.colour) for subtree, r
+                      in zip(tree._subtrees, tree._child_rects(rect))]
+    rectangles, token = tree.generate_treemap_lod(rect, max_rects=6,
+                                                  token=token)
+    assert len(coarse) <= len(rectangles) <= 6
+
+    while token is not None:
+        rectangles, token = tree.generate_treemap_lod(rect, seconds=0,
+                                                      token=token)
+    assert rectangles == expected
+    assert tree.generate_treemap_lod(rect, seconds=0) == (expected, None)
+
+
+def test_squarify_layout_fills_rect() -> None:
+    sizes = [1, 0, 40, 3, 3, 250, 9]
+    rects = squarify_layout((5, 10, 300, 200), sizes, sum(sizes))
+    drawn = [r for r, size in zip(rects, sizes) if size > 0]
+
+    assert sum(r[2] * r[3] for r in drawn) == 300 * 200
+    assert all(not rects_overlap(a, b)
+               for i, a in enumerate(drawn) for b in drawn[:i])
+    assert rects[1][2:] == (0, 0)
+    assert max(rects[5][2], rects[5][3]) < 2 * min(rects[5][2], rects[5][3])
+
+
+def test_generate_treemap_squarified_mode() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    rect = (0, 0, 800, 1000)
+    sliced = tree.generate_treemap(rect)
+
+    tree.squarified = True
+    squarified = tree.generate_treemap(rect)
+    assert squarified != sliced
+    assert sorted(colour for _, colour in squarified) == \
+        sorted(colour for _, colour in sliced)
+    assert sum(r[2] * r[3] for r, _ in squarified) == 800 * 1000
+
+    tree._layout_cache = None
+    assert tree.generate_treemap(rect) == squarified
+    r, _, leaf = list(tree.iter_treemap(rect))[-1]
+    assert tree.coordinate_to_tree((r[0], r[1]), rect) is leaf
+
+
+def test_coordinate_to_tree_reuses_hit_index() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    rect = (0, 0, 800, 1000)
+    layout = list(tree.iter_treemap(rect))
+
+    for r, _, leaf in layout:
+        assert tree.coordinate_to_tree((r[0] + r[2] - 1, r[1]), rect) is leaf
+    index = tree._hit_index
+    assert tree.coordinate_to_tree((800, 0), rect) is None
+    assert tree._hit_index is index
+
+    r, _, leaf = layout[0]
+    tree.mouse_right((r[0], r[1]), rect)
+    assert tree.coordinate_to_tree((r[0], r[1]), rect) is not leaf
+    assert tree._hit_index is not index
+
+
+def test_coordinate_to_tree_indexes_only_the_clip() -> None:
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    view, clip = (-3200, -4000, 6400, 8000), (0, 0, 800, 1000)
+    layout = list(tree.iter_treemap(view, 0, (-3200, -4000, 4000, 5000)))
+
+    for r, _, leaf in layout[::7]:
+        x, y = r[0] + r[2] - 1, r[1]
+        assert tree.coordinate_to_tree((x, y), view, clip) is leaf
+    assert len(tree._hit_index._cells) == 25 * 32
+
+
+def test_delete_node_collapses_empty_folders() -> None:
+    first = FileSystemTree(None, 'same.txt', [], 5)
+    second = FileSystemTree(None, 'same.txt', [], 7)
+    inner = FileSystemTree(None, 'inner', [second])
+    folder = FileSystemTree(None, 'folder', [inner])
+    other = FileSystemTree(None, 'other.txt', [], 3)
+    tree = FileSystemTree(None, 'root', [first, folder, other])
+
+    tree.delete_node(second)
+    assert tree.data_size == 8
+    assert inner.is_empty() and folder.is_empty()
+    assert not first.is_empty()
+    assert tree.generate_treemap((0, 0, 80, 10)) == [
+        ((0, 0, 50, 10), first.colour), ((50, 0, 30, 10), other.colour)]
+
+    tree.delete_node(other)
+    tree.delete_node(first)
+    assert tree.data_size == 0 and tree._subtrees == []
+    assert not tree.is_empty()
+
+
+def test_apply_size_deltas_updates_each_ancestor_once() -> None:
+    a = FileSystemTree(None, 'a', [], 5)
+    b = FileSystemTree(None, 'b', [], 7)
+    c = FileSystemTree(None, 'c', [], 3)
+    folder = FileSystemTree(None, 'folder', [a, b])
+    tree = FileSystemTree(None, 'root', [folder, c])
+    version = tree._version
+
+    tree.apply_size_deltas({a: 4, b: -2, c: 1})
+    assert (a.data_size, b.data_size, c.data_size) == (9, 5, 4)
+    assert folder.data_size == 14 and tree.data_size == 18
+    assert tree._version == version + 1
+
+    with pytest.raises(ValueError):
+        tree.apply_size_deltas({a: 1, b: -6})
+    assert (a.data_size, b.data_size, tree.data_size) == (9, 5, 18)
+
+    compact = CompactTree(tree)
+    compact.apply_size_deltas({2: 1, 3: -5, 4: 2})
+    assert compact.generate_treemap((0, 0, 16, 1)) == [
+        ((0, 0, 10, 1), a.colour), ((10, 0, 6, 1), c.colour)]
+
+
+def test_apply_size_deltas_that_cancel_out_redraw() -> None:
+    a = FileSystemTree(None, 'a', [], 10)
+    b = FileSystemTree(None, 'b', [], 10)
+    tree = FileSystemTree(None, 'root', [a, b])
+    assert len(tree.generate_treemap((0, 0, 100, 1))) == 2
+    assert len(tree.leaves()) == 2
+
+    tree.apply_size_deltas({a: 10, b: -10})
+    assert tree.data_size == 20
+    assert tree.generate_treemap((0, 0, 100, 1)) == [
+        ((0, 0, 100, 1), a.colour)]
+    assert tree.leaves() == [a]
+
+
+def test_find_and_path_reuse_cached_paths() -> None:
+    a = FileSystemTree(None, 'a.txt', [], 5)
+    b = FileSystemTree(None, 'b.txt', [], 7)
+    folder = FileSystemTree(None, 'folder', [a, b])
+    tree = FileSystemTree(None, 'root', [folder])
+    path = os.path.join('root', 'folder', 'a.txt')
+
+    assert tree.find(path) is a
+    assert tree.find(os.path.join('root', 'folder')) is folder
+    assert tree.find(os.path.join('root', 'missing')) is None
+    assert tree.find(os.path.join('other', 'folder')) is None
+
+    label = a.path()
+    assert label == path + ' (5)'
+    assert a.path() is label
+    assert b.path().startswith(folder._path_cache[2])
+
+    index = folder._name_index
+    a.increase_decrease_parent(a.increase_decrease(True), True)
+    assert a.path() == path + ' (6)'
+    assert tree.find(path) is a and folder._name_index is index
+    folder._root = 'renamed'
+    folder._renamed()
+    assert a.path() == os.path.join('root', 'renamed', 'a.txt') + ' (6)'
+    assert tree.find(os.path.join('root', 'renamed', 'b.txt')) is b
+    tree.delete_node(b)
+    assert tree.find(os.path.join('root', 'renamed', 'b.txt')) is None
+
+
+def test_node_counts_follow_changes() -> None:
+    a = FileSystemTree(None, 'a.txt', [], 5)
+    b = FileSystemTree(None, 'b.txt', [], 7)
+    folder = FileSystemTree(None, 'folder', [a, b])
+    empty = FileSystemTree(None, 'empty')
+    tree = FileSystemTree(None, 'root', [folder, empty])
+    assert len(tree) == 5
+
+    leaves = tree.leaves()
+    assert leaves == [a, b]
+    assert tree.leaves() == leaves and tree.leaves() is not leaves
+
+    c = FileSystemTree(None, 'c.txt', [], 1)
+    empty.add_subtrees([c, FileSystemTree(None, 'd.txt', [], 2)])
+    assert len(tree) == 7
+    assert tree.leaves()[2] is c
+
+    tree.delete_node(a)
+    tree.delete_node(b)
+    assert len(tree) == 4
+    empty.delete_item('d.txt')
+    empty.delete_node(c)
+    assert len(tree) == 2
+    assert tree.leaves() == [empty]
+
+
+def test_replace_subtrees_resets_the_tree() -> None:
+    files = [FileSystemTree(None, 'f{}'.format(i), [], 1) for i in range(4)]
+    folder = FileSystemTree(None, 'folder', files)
+    tree = FileSystemTree(None, 'root', [folder])
+    tree.delete_node(files[0])
+    assert folder._removed == 1
+    assert tree.find(os.path.join('root', 'folder', 'f1')) is files[1]
+
+    new = FileSystemTree(None, 'new', [], 9)
+    folder.replace_subtrees([new])
+    assert folder._subtrees == [new] and folder._removed == 0
+    assert files[1]._parent_tree is None
+    assert folder.data_size == 9 and tree.data_size == 9
+    assert len(tree) == 3
+    assert tree.leaves() == [new]
+    assert tree.find(os.path.join('root', 'folder', 'f1')) is None
+    assert tree.find(os.path.join('root', 'folder', 'new')) is new
+
+    folder.replace_subtrees([])
+    assert tree.data_size == 0 and len(tree) == 2
+
+
+def test_deep_tree_does_not_recurse() -> None:
+    leaf = FileSystemTree(None, 'leaf', [], 5)
+    tree = leaf
+    for i in range(150000):
+        tree = FileSystemTree(None, 'd{}'.format(i), [tree])
+
+    assert len(tree) == 150001
+    assert tree.leaves() == [leaf]
+    assert tree.generate_treemap((0, 0, 30, 20)) == [((0, 0, 30, 20),
+                                                      leaf.colour)]
+    assert len(leaf.node_appender()) == 150001
+    leaf.increase_decrease_parent(3, True)
+    assert tree.data_size == 8
+    leaf.reduce_size(8)
+    assert tree.data_size == 0
+    tree.delete_item('leaf')
+    assert len(tree) == 150000
+
+
 ##############################################################################
 # Helper to sort subtrees alphabetically
 ##############################################################################
@@ -129,5 +779,17 @@ def _sort_subtrees(tree: AbstractTree) -> None:
         tree._subtrees.sort(key=lambda t: t._root)
 
 
+def _same_tree(first: AbstractTree, second: AbstractTree) -> bool:
+    """Return True iff <first> and <second> have the same names, data sizes
+    and shape.
+    """
+    if first._root != second._root or first.data_size != second.data_size \
+            or len(first._subtrees) != len(second._subtrees):
+        return False
+
+    return all(_same_tree(a, b)
+               for a, b in zip(first._subtrees, second._subtrees))
+
+
 if __name__ == '__main__':
     pytest.main(['a2_test.py'])
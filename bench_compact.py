@@ -0,0 +1,100 @@
+"""Compare the memory use and speed of CompactTree with an AbstractTree.
+
+A balanced synthetic tree is built with one object per node, then converted
+to a CompactTree, e.g.
+
+    python bench_compact.py --leaves 200000 --fanout 10 --workers 8
+"""
+import argparse
+import time
+import tracemalloc
+
+from typing import Callable, Tuple, Any, Optional
+
+from tree_data import FileSystemTree, AbstractTree
+from compact_tree import CompactTree, numpy
+from parallel_layout import ParallelLayout
+
+RECT = (0, 0, 1024, 738)
+
+
+def make_tree(leaves: int, fanout: int) -> AbstractTree:
+    """Return a balanced tree with <leaves> leaves of varying sizes and at
+    most <fanout> subtrees per node.
+    """
+    level = [FileSystemTree(None, 'file{}'.format(i), [], 1 + i * 7919 % 5000)
+             for i in range(leaves)]
+    depth = 0
+    while len(level) > 1:
+        depth += 1
+        level = [FileSystemTree(None, 'dir{}_{}'.format(depth, i),
+                                level[i:i + fanout])
+                 for i in range(0, len(level), fanout)]
+    return level[0]
+
+
+def measure(func: Callable, *args) -> Tuple[Any, float, int]:
+    """Return the result of func(*args), the seconds it took and the bytes
+    it left allocated.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, allocated
+
+
+def timed(func: Callable, *args) -> float:
+    """Return the seconds taken by func(*args)."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(leaves: int, fanout: int, workers: Optional[int]) -> None:
+    """Build both trees and print how they compare.
+
+    If <workers> is given, also time a ParallelLayout with that many
+    workers.
+    """
+    tree, build_objects, objects_bytes = measure(make_tree, leaves, fanout)
+    compact, build_compact, compact_bytes = measure(CompactTree, tree)
+
+    print('{} nodes'.format(len(tree)))
+    print('{:<22}{:>14}{:>14}'.format('', 'AbstractTree', 'CompactTree'))
+    print('{:<22}{:>14.1f}{:>14.1f}'.format(
+        'memory (MB)', objects_bytes / 2 ** 20, compact_bytes / 2 ** 20))
+    print('{:<22}{:>14.3f}{:>14.3f}'.format(
+        'build (s)', build_objects, build_compact))
+    for name in ['generate_treemap', 'leaves']:
+        args = (RECT,) if name == 'generate_treemap' else ()
+        print('{:<22}{:>14.3f}{:>14.3f}'.format(
+            name + ' (s)', timed(getattr(tree, name), *args),
+            timed(getattr(compact, name), *args)))
+    print('{:<22}{:>14.3f}{:>14}'.format(
+        'cached redraw (s)', timed(tree.generate_treemap, RECT), ''))
+    if numpy is not None:
+        print('{:<22}{:>14}{:>14.3f}'.format(
+            'layout_arrays (s)', '', timed(compact.layout_arrays, RECT)))
+    if workers is not None:
+        layout = ParallelLayout(compact, workers)
+        layout.generate_treemap(RECT)
+        print('{:<22}{:>14}{:>14.3f}'.format(
+            'parallel layout (s)', '', timed(layout.generate_treemap, RECT)))
+        layout.close()
+    print('{:<22}{:>14.6f}{:>14.6f}'.format(
+        'coordinate_to_tree (s)',
+        timed(tree.coordinate_to_tree, (500, 400), RECT),
+        timed(compact.coordinate_to_tree, (500, 400), RECT)))
+    assert compact.generate_treemap(RECT) == tree.generate_treemap(RECT)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--leaves', type=int, default=100000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+    main(args.leaves, args.fanout, args.workers)
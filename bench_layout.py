@@ -0,0 +1,116 @@
+"""Benchmark generate_treemap on wide and deep synthetic trees.
+
+A wide tree is a single folder holding n files, so all the work is in slicing
+one node between its children. With the prefix-sum layout the time per child
+stays flat as n grows. A deep tree is a chain of n nested folders, which the
+layout walks without recursing. A balanced tree is laid out with and without
+culling subtrees smaller than a few pixels, and zoomed in with only the
+part on screen laid out, e.g.
+
+    python bench_layout.py --widths 1000 10000 100000 --depths 100000
+"""
+import argparse
+import time
+
+from typing import List, Optional, Tuple
+
+from tree_data import FileSystemTree, AbstractTree
+from bench_compact import make_tree
+
+RECT = (0, 0, 1024, 738)
+
+
+def make_wide_tree(width: int) -> AbstractTree:
+    """Return a folder holding <width> files of varying sizes."""
+    return FileSystemTree(None, 'wide', [
+        FileSystemTree(None, 'file{}'.format(i), [], 1 + i * 7919 % 5000)
+        for i in range(width)])
+
+
+def make_deep_tree(depth: int) -> AbstractTree:
+    """Return a chain of <depth> folders with a single file at the bottom."""
+    tree = FileSystemTree(None, 'file', [], 1)
+    for i in range(depth):
+        tree = FileSystemTree(None, 'dir{}'.format(i), [tree])
+    return tree
+
+
+def clear_layouts(tree: AbstractTree) -> None:
+    """Forget the cached layout of every subtree of <tree>."""
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        subtree._layout_cache = None
+        stack.extend(subtree._subtrees)
+
+
+def best_of(repeat: int, tree: AbstractTree, min_side: int = 0,
+            zoom: int = 1) -> float:
+    """Return the fastest of <repeat> layouts of <tree> from scratch, in
+    seconds, zoomed in <zoom> times on the centre of RECT if <zoom> is more
+    than 1.
+    """
+    view, clip = zoomed(zoom)
+    best = float('inf')
+    for _ in range(repeat):
+        clear_layouts(tree)
+        start = time.perf_counter()
+        tree.generate_treemap(view, min_side, clip)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def zoomed(zoom: int) -> Tuple[Tuple[int, int, int, int],
+                              Optional[Tuple[int, int, int, int]]]:
+    """Return the rectangle to lay a tree out in to zoom in <zoom> times on
+    the centre of RECT, and the clip rectangle, or None if <zoom> is 1.
+    """
+    if zoom == 1:
+        return RECT, None
+    width, height = RECT[2] * zoom, RECT[3] * zoom
+    return ((RECT[2] - width) // 2, (RECT[3] - height) // 2, width,
+            height), RECT
+
+
+def main(widths: List[int], depths: List[int], leaves: int,
+         repeat: int) -> None:
+    """Print the layout time of a wide tree of each width, a deep tree of
+    each depth and a balanced tree with <leaves> leaves.
+    """
+    print('{:>10}{:>12}{:>18}'.format('children', 'seconds', 'us per child'))
+    for width in widths:
+        seconds = best_of(repeat, make_wide_tree(width))
+        print('{:>10}{:>12.4f}{:>18.3f}'.format(width, seconds,
+                                                seconds / width * 1e6))
+
+    print('{:>10}{:>12}{:>18}'.format('depth', 'seconds', 'us per level'))
+    for depth in depths:
+        seconds = best_of(repeat, make_deep_tree(depth))
+        print('{:>10}{:>12.4f}{:>18.3f}'.format(depth, seconds,
+                                                seconds / depth * 1e6))
+
+    tree = make_tree(leaves, 10)
+    print('{:>10}{:>12}{:>18}'.format('min_side', 'seconds', 'rectangles'))
+    for min_side in [0, 1, 2, 4]:
+        seconds = best_of(repeat, tree, min_side)
+        print('{:>10}{:>12.4f}{:>18}'.format(
+            min_side, seconds, len(tree.generate_treemap(RECT, min_side))))
+
+    print('{:>10}{:>12}{:>18}'.format('zoom', 'seconds', 'rectangles'))
+    for zoom in [1, 4, 16, 64]:
+        view, clip = zoomed(zoom)
+        seconds = best_of(repeat, tree, 2, zoom)
+        print('{:>10}{:>12.4f}{:>18}'.format(
+            zoom, seconds, len(tree.generate_treemap(view, 2, clip))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--widths', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--depths', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--leaves', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.widths, args.depths, args.leaves, args.repeat)
@@ -0,0 +1,87 @@
+"""Benchmark scan_file_system against the recursive FileSystemTree constructor.
+
+A directory tree is generated in a temporary folder and scanned with both,
+e.g.
+
+    python bench_scan.py --depth 4 --fanout 6 --files 20 --workers 1 4 16
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from typing import List
+
+from tree_data import FileSystemTree, AbstractTree
+from scanner import scan_file_system
+
+
+def make_tree(path: str, depth: int, fanout: int, files: int) -> None:
+    """Create <files> files and <fanout> subdirectories in <path>, down to
+    <depth> levels of folders.
+    """
+    for i in range(files):
+        with open(os.path.join(path, 'file{}.dat'.format(i)), 'wb') as f:
+            f.write(b'x' * (i * 37 % 4096))
+
+    if depth > 0:
+        for i in range(fanout):
+            subdir = os.path.join(path, 'dir{}'.format(i))
+            os.mkdir(subdir)
+            make_tree(subdir, depth - 1, fanout, files)
+
+
+def best_of(repeat: int, func, *args) -> float:
+    """Return the fastest of <repeat> timed calls of func(*args), in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(depth: int, fanout: int, files: int, workers: List[int],
+         repeat: int) -> None:
+    """Generate a tree and print the scan time of each scanner."""
+    with tempfile.TemporaryDirectory() as path:
+        make_tree(path, depth, fanout, files)
+
+        expected = FileSystemTree(path)
+        for count in workers:
+            tree = scan_file_system(path, count)
+            assert _same_shape(expected, tree)
+
+        print('{} nodes, {} bytes'.format(len(expected), expected.data_size))
+        print('{:<28}{:>10}'.format('scanner', 'seconds'))
+        print('{:<28}{:>10.3f}'.format(
+            'FileSystemTree', best_of(repeat, FileSystemTree, path)))
+        for count in workers:
+            print('{:<28}{:>10.3f}'.format(
+                'scan_file_system({})'.format(count),
+                best_of(repeat, scan_file_system, path, count)))
+
+
+def _same_shape(first: AbstractTree, second: AbstractTree) -> bool:
+    """Return True iff both trees have the same names, sizes and structure.
+    """
+    stack = [(first, second)]
+    while stack:
+        a, b = stack.pop()
+        if a._root != b._root or a.data_size != b.data_size \
+                or len(a._subtrees) != len(b._subtrees):
+            return False
+        stack.extend(zip(a._subtrees, b._subtrees))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.depth, args.fanout, args.files, args.workers, args.repeat)
@@ -0,0 +1,90 @@
+"""Compare the squarified layout with slice-and-dice on the same trees.
+
+For each layout mode, print the time to lay a tree out from scratch, the
+time to lay it out again in a rectangle twice the size, when only the
+squarified row partitions are still cached, the number of rectangles less
+than a pixel wide or high, and the average ratio of the long side to the
+short side of the others, e.g.
+
+    python bench_squarify.py --leaves 100000 --width 20000
+"""
+import argparse
+import gc
+import time
+
+from typing import List, Tuple
+
+from tree_data import AbstractTree
+from bench_compact import make_tree
+from bench_layout import make_wide_tree, clear_layouts
+
+RECT = (0, 0, 1024, 738)
+
+
+def clear_splits(tree: AbstractTree) -> None:
+    """Forget the cached row partition of every subtree of <tree>."""
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        subtree._split_cache = None
+        stack.extend(subtree._subtrees)
+
+
+def shape(rectangles: List[Tuple[Tuple[int, int, int, int],
+                                 Tuple[int, int, int]]]) -> Tuple[int, float]:
+    """Return the number of <rectangles> less than a pixel wide or high, and
+    the average aspect ratio of the rest.
+    """
+    degenerate = 0
+    ratios = 0.0
+    for (_, _, width, height), _ in rectangles:
+        if width < 1 or height < 1:
+            degenerate += 1
+        else:
+            ratios += max(width, height) / min(width, height)
+    drawn = len(rectangles) - degenerate
+    return degenerate, ratios / drawn if drawn else 0.0
+
+
+def compare(name: str, tree: AbstractTree) -> None:
+    """Print how the two layout modes compare on <tree>."""
+    larger = (RECT[0], RECT[1], RECT[2] * 2, RECT[3] * 2)
+    for squarified in [False, True]:
+        tree.squarified = squarified
+        clear_layouts(tree)
+        clear_splits(tree)
+        gc.collect()
+        start = time.perf_counter()
+        rectangles = tree.generate_treemap(RECT)
+        seconds = time.perf_counter() - start
+
+        clear_layouts(tree)
+        gc.collect()
+        start = time.perf_counter()
+        tree.generate_treemap(larger)
+        again = time.perf_counter() - start
+
+        degenerate, aspect = shape(rectangles)
+        print('{:>10}{:>12}{:>10.4f}{:>10.4f}{:>12}{:>10.2f}'.format(
+            name, 'squarified' if squarified else 'slice', seconds, again,
+            degenerate, aspect))
+    tree.squarified = False
+
+
+def main(leaves: int, fanout: int, width: int) -> None:
+    """Compare the layout modes on a balanced tree with <leaves> leaves and
+    <fanout> subtrees per node, and on a folder of <width> files.
+    """
+    print('{:>10}{:>12}{:>10}{:>10}{:>12}{:>10}'.format(
+        'tree', 'layout', 'seconds', 'again', 'sub-pixel', 'aspect'))
+    compare('balanced', make_tree(leaves, fanout))
+    compare('wide', make_wide_tree(width))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--leaves', type=int, default=100000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--width', type=int, default=20000)
+    args = parser.parse_args()
+    main(args.leaves, args.fanout, args.width)
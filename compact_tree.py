@@ -0,0 +1,674 @@
+"""A compact, array-backed alternative to trees of AbstractTree objects.
+
+Every AbstractTree node is a full Python object with its own attribute
+dictionary, subtree list and colour tuple, which adds up to gigabytes for
+tens of millions of nodes. A CompactTree stores the same information as a
+handful of flat arrays, one entry per node, and supports the operations the
+treemap visualiser needs.
+
+A CompactTree can be saved to a binary snapshot with save_compact and opened
+again with load_compact, which maps the file into memory instead of reading
+it, so only the pages that are actually used are ever loaded.
+
+If NumPy is installed, CompactTree.layout_arrays lays out the whole tree a
+level at a time with array arithmetic, and returns the rectangles as arrays
+instead of a list of tuples.
+"""
+from __future__ import annotations
+import math
+import mmap
+import struct
+import sys
+from array import array
+
+from typing import Tuple, List, Optional, Dict, Any, Union, Iterator
+
+from tree_data import AbstractTree, LayoutToken, coordinates_in_range, \
+    rects_overlap, slice_layout
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The layout of a snapshot file: a header, the separator, then each array
+# section in the order of _SECTIONS. Every part starts at a multiple of 8
+# bytes, so each section can be viewed in place as an array of its type.
+# Numbers are in the byte order of the machine that wrote the file.
+_MAGIC = b'TMAP'
+_ORDER = b'LE\0\0' if sys.byteorder == 'little' else b'BE\0\0'
+# magic, byte order, nodes, children, name bytes, separator bytes, live nodes
+_HEADER = struct.Struct('=4s4sqqqqq')
+# attribute, array type code, number of entries (in terms of the header)
+_SECTIONS = [('_parents', 'q', 'nodes'),
+             ('_child_offsets', 'q', 'nodes + 1'),
+             ('_children', 'q', 'children'),
+             ('_sizes', 'q', 'nodes'),
+             ('_colours', 'I', 'nodes'),
+             ('_name_offsets', 'q', 'nodes + 1'),
+             ('_removed', 'B', 'nodes'),
+             ('_names', 'B', 'names')]
+
+
+class CompactTree:
+    """A tree stored as a structure of arrays.
+
+    Nodes are identified by their index in a preorder traversal, so the root
+    is node 0 and each subtree's nodes have consecutive indices, with the
+    subtree's root first. Empty AbstractTree nodes are not stored.
+
+    === Private Attributes ===
+    _parents: the index of each node's parent, or -1 for the root.
+    _child_offsets: the children of node i are
+        _children[_child_offsets[i]:_child_offsets[i + 1]], in order.
+    _children: the child indices of every node, grouped by parent.
+    _sizes: the data_size of each node.
+    _colours: the colour of each node, packed as 0xRRGGBB.
+    _name_offsets: the name of node i is the UTF-8 text
+        _names[_name_offsets[i]:_name_offsets[i + 1]].
+    _names: the names of every node, concatenated.
+    _removed: 1 for each node that has been deleted, 0 otherwise.
+    _separator: the separator used between names in paths.
+    _count: the number of nodes that have not been deleted.
+
+    Each array may instead be a memoryview of a snapshot file with the same
+    type code; see load_compact.
+
+    === Representation Invariants ===
+    - Every array holding one entry per node has the same length, and
+      _child_offsets and _name_offsets have one more entry than that.
+    - If a node has children that have not been deleted, its size is the sum
+      of their sizes.
+    - A deleted node has size 0.
+    """
+    _parents: array
+    _child_offsets: array
+    _children: array
+    _sizes: array
+    _colours: array
+    _name_offsets: array
+    _names: Union[bytes, memoryview]
+    _removed: Union[bytearray, memoryview]
+    _separator: str
+    _count: int
+
+    def __init__(self: CompactTree,
+                 tree: Optional[AbstractTree] = None) -> None:
+        """Initialize a CompactTree holding the same nodes as <tree>, or an
+        empty CompactTree if <tree> is None.
+        """
+        if tree is None:
+            tree = AbstractTree(None, [])
+
+        self._parents = array('q')
+        self._child_offsets = array('q')
+        self._children = array('q')
+        self._sizes = array('q')
+        self._colours = array('I')
+        self._name_offsets = array('q', [0])
+        names = bytearray()
+        self._separator = tree.get_separator() if not tree.is_empty() else ''
+
+        # Number the nodes in preorder, remembering each node's parent.
+        nodes = []
+        stack = [] if tree.is_empty() else [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            self._parents.append(parent)
+            self._sizes.append(node.data_size)
+            r, g, b = node.colour
+            self._colours.append((r << 16) | (g << 8) | b)
+            names.extend(str(node._root).encode('utf-8'))
+            self._name_offsets.append(len(names))
+            for subtree in reversed(node._subtrees):
+                if not subtree.is_empty():
+                    stack.append((subtree, index))
+
+        # Children appear in the order their parents were numbered, and
+        # siblings in their original order, so one pass fills the offsets.
+        counts = [0] * (len(nodes) + 1)
+        for parent in self._parents:
+            counts[parent + 1] += 1
+        offset = 0
+        for index in range(len(nodes)):
+            self._child_offsets.append(offset)
+            offset += counts[index + 1]
+        self._child_offsets.append(offset)
+
+        self._children = array('q', [0] * offset)
+        filled = list(self._child_offsets[:-1])
+        for index in range(1, len(nodes)):
+            parent = self._parents[index]
+            self._children[filled[parent]] = index
+            filled[parent] += 1
+
+        self._names = bytes(names)
+        self._removed = bytearray(len(nodes))
+        self._count = len(nodes)
+
+    def __len__(self: CompactTree) -> int:
+        """Return the number of nodes in this tree."""
+        return self._count
+
+    def is_empty(self: CompactTree) -> bool:
+        """Return True if this tree is empty."""
+        return self._count == 0
+
+    def get_separator(self: CompactTree) -> str:
+        """Return the string used to separate names in a path."""
+        return self._separator
+
+    def name(self: CompactTree, index: int) -> str:
+        """Return the name of node <index>."""
+        return str(self._names[self._name_offsets[index]:
+                               self._name_offsets[index + 1]], 'utf-8')
+
+    def colour(self: CompactTree, index: int) -> Tuple[int, int, int]:
+        """Return the colour of node <index>."""
+        packed = self._colours[index]
+        return packed >> 16, (packed >> 8) & 0xFF, packed & 0xFF
+
+    def children(self: CompactTree, index: int) -> List[int]:
+        """Return the indices of the children of node <index> that have not
+        been deleted, in order.
+        """
+        removed = self._removed
+        return [child for child in self._children[
+            self._child_offsets[index]:self._child_offsets[index + 1]]
+            if not removed[child]]
+
+    def leaves(self: CompactTree) -> List[int]:
+        """Return the indices of every leaf with a positive size, in the
+        order generate_treemap draws them.
+        """
+        # A node whose children have all been deleted has size 0, so only
+        # nodes that never had children need to be considered.
+        offsets = self._child_offsets
+        sizes = self._sizes
+        return [index for index in range(len(sizes))
+                if offsets[index] == offsets[index + 1] and sizes[index] > 0
+                and not self._removed[index]]
+
+    def generate_treemap(self: CompactTree, rect: Tuple[int, int, int, int],
+                         min_side: int = 0,
+                         clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Run the treemap algorithm on this tree and return the rectangles,
+        exactly as AbstractTree.generate_treemap does for the same tree,
+        <min_side> and <clip>.
+
+        The rectangles come from layout_arrays if NumPy is installed and
+        <clip> is not given.
+        """
+        if clip is not None:
+            return [(r, self.colour(index))
+                    for r, index in self._iter_layout(rect, min_side, 0,
+                                                      clip)]
+        if numpy is not None:
+            rects, colours, _ = self.layout_arrays(rect, min_side)
+            return list(zip(map(tuple, rects.tolist()),
+                            map(tuple, colours.tolist())))
+        return [(r, self.colour(index))
+                for r, index in self._layout(rect, min_side)]
+
+    def generate_treemap_lod(self: CompactTree,
+                             rect: Tuple[int, int, int, int],
+                             min_side: int = 0,
+                             clip: Optional[Tuple[int, int, int, int]] = None,
+                             max_depth: Optional[int] = None,
+                             max_rects: Optional[int] = None,
+                             seconds: Optional[float] = None,
+                             token: Optional[LayoutToken] = None) \
+            -> Tuple[List[Tuple[Tuple[int, int, int, int],
+                                Tuple[int, int, int]]],
+                     Optional[LayoutToken]]:
+        """Return generate_treemap(rect, min_side, clip) and None, so that a
+        CompactTree can be drawn wherever AbstractTree.generate_treemap_lod
+        is used.
+
+        A CompactTree is always laid out completely in one pass, so
+        <max_depth>, <max_rects>, <seconds> and <token> are ignored.
+        """
+        return self.generate_treemap(rect, min_side, clip), None
+
+    def iter_treemap(self: CompactTree, rect: Tuple[int, int, int, int],
+                     min_side: int = 0,
+                     clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int],
+                              CompactNode]]:
+        """Yield the rectangles of generate_treemap(rect, min_side, clip) in
+        the same order, each with its colour and the node it is drawn for,
+        as AbstractTree.iter_treemap does.
+        """
+        for r, index in self._iter_layout(rect, min_side, 0, clip):
+            yield r, self.colour(index), CompactNode(self, index)
+
+    def _layout(self: CompactTree, rect: Tuple[int, int, int, int],
+                min_side: int = 0, index: int = 0) \
+            -> List[Tuple[Tuple[int, int, int, int], int]]:
+        """Return a (rectangle, node index) pair for every leaf, or culled
+        subtree, drawn when the subtree rooted at node <index> is drawn in
+        <rect>, in drawing order.
+
+        Subtrees are culled as in AbstractTree.generate_treemap.
+        """
+        return list(self._iter_layout(rect, min_side, index))
+
+    def _iter_layout(self: CompactTree, rect: Tuple[int, int, int, int],
+                     min_side: int = 0, index: int = 0,
+                     clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], int]]:
+        """Yield the pairs of _layout(rect, min_side, index) as they are laid
+        out, leaving out those that do not overlap <clip> if it is given.
+        """
+        if self.is_empty():
+            return
+
+        stack = [(index, rect)]
+        while stack:
+            index, r = stack.pop()
+            if self._sizes[index] == 0:
+                continue
+            culled = min_side > 0 and min(r[2], r[3]) < min_side
+            if culled and (r[2] <= 0 or r[3] <= 0):
+                continue
+            if clip is not None and not rects_overlap(r, clip):
+                continue
+            children = [] if culled else self.children(index)
+            if not children:
+                yield r, index
+            else:
+                pairs = list(zip(children, self._child_rects(index, r)))
+                stack.extend(reversed(pairs))
+
+    def _child_rects(self: CompactTree, index: int,
+                     rect: Tuple[int, int, int, int]) \
+            -> List[Tuple[int, int, int, int]]:
+        """Return the rectangle of each child of node <index> when the node is
+        drawn in <rect>, as AbstractTree does.
+        """
+        sizes = self._sizes
+        return slice_layout(rect, [sizes[child]
+                                   for child in self.children(index)],
+                            sizes[index])
+
+    def layout_arrays(self: CompactTree, rect: Tuple[int, int, int, int],
+                      min_side: int = 0, index: int = 0) \
+            -> Tuple[Any, Any, Any]:
+        """Run the treemap algorithm on the subtree rooted at node <index>
+        and return the rectangles as NumPy arrays (rects, colours, leaves),
+        in drawing order.
+
+        Row i of the int64 array <rects> is the (x, y, width, height) of the
+        leaf whose index is leaves[i], and row i of the uint8 array <colours>
+        is its (r, g, b) colour. The rows are exactly the tuples returned by
+        generate_treemap. If <min_side> is positive, subtrees are culled as
+        in generate_treemap, and a culled subtree's index is in <leaves>.
+
+        The tree is laid out a level at a time, with a fixed number of array
+        operations per level, so no Python code runs per node.
+
+        Raise ImportError if NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('layout_arrays requires NumPy')
+
+        sizes = numpy.frombuffer(self._sizes, numpy.int64)
+        offsets = numpy.frombuffer(self._child_offsets, numpy.int64)
+        children = numpy.frombuffer(self._children, numpy.int64)
+        removed = numpy.frombuffer(self._removed, numpy.uint8)
+        pruned = self._count < len(self._sizes)
+
+        # The nodes on the current level, with their rectangles, and the
+        # leaves found on each level so far.
+        level = [numpy.array([] if self.is_empty() else [index],
+                             numpy.int64)]
+        level.extend(numpy.full(len(level[0]), value, numpy.int64)
+                     for value in rect)
+        found = [[numpy.zeros(0, numpy.int64)] * 5]
+
+        while len(level[0]):
+            nodes = level[0]
+            counts = offsets[nodes + 1] - offsets[nodes]
+            visible = sizes[nodes] > 0
+            leaf = counts == 0
+            if min_side > 0:
+                side = numpy.minimum(level[3], level[4])
+                visible &= side > 0
+                leaf |= side < min_side
+            drawn = visible & leaf
+            found.append([column[drawn] for column in level])
+            visible &= ~leaf
+            level = [column[visible] for column in level]
+            nodes, x, y, w, h = level
+            counts = counts[visible]
+
+            # Gather the children of every node on this level, in order,
+            # with <parents> holding the position of each one's parent.
+            before = numpy.cumsum(counts) - counts
+            parents = numpy.repeat(numpy.arange(len(nodes)), counts)
+            kids = children[numpy.arange(len(parents))
+                            + numpy.repeat(offsets[nodes] - before, counts)]
+
+            if pruned:
+                live = removed[kids] == 0
+                kids, parents = kids[live], parents[live]
+                counts = numpy.bincount(parents, minlength=len(nodes))
+
+                # A node whose children have all been deleted is drawn as a
+                # leaf, as in _layout.
+                bare = counts == 0
+                found.append([column[bare] for column in level])
+                parents = (numpy.cumsum(~bare) - 1)[parents]
+                level = [column[~bare] for column in level]
+                nodes, x, y, w, h = level
+                counts = counts[~bare]
+                before = numpy.cumsum(counts) - counts
+
+            if not len(kids):
+                break
+
+            # Slice each node's rectangle between its children exactly as
+            # slice_layout does: the same floating point shares, a running
+            # sum of them within each node, and the remainder to the last
+            # child with a positive size.
+            horizontal = w > h
+            origin = numpy.where(horizontal, x, y)
+            length = numpy.where(horizontal, w, h)
+            kid_sizes = sizes[kids]
+            shares = numpy.floor(kid_sizes / sizes[nodes][parents]
+                                 * length[parents]).astype(numpy.int64)
+            running = numpy.cumsum(shares) - shares
+            start = (origin - running[before])[parents] + running
+
+            index = numpy.arange(len(kids))
+            last = numpy.maximum(before, numpy.maximum.reduceat(
+                numpy.where(kid_sizes > 0, index, 0), before))
+            extent = numpy.where(index < last[parents], shares,
+                                 (origin + length)[parents] - start)
+
+            across = numpy.where(horizontal, y, x)[parents]
+            breadth = numpy.where(horizontal, h, w)[parents]
+            horizontal = horizontal[parents]
+            level = [kids,
+                     numpy.where(horizontal, start, across),
+                     numpy.where(horizontal, across, start),
+                     numpy.where(horizontal, extent, breadth),
+                     numpy.where(horizontal, breadth, extent)]
+
+        leaves, x, y, w, h = (numpy.concatenate(column)
+                              for column in zip(*found))
+
+        # Indices are in preorder, which is the order leaves are drawn in.
+        # Each level's leaves are already sorted, so this is usually quick.
+        if (leaves[1:] < leaves[:-1]).any():
+            order = numpy.argsort(leaves, kind='stable')
+            leaves, x, y, w, h = (column[order]
+                                  for column in (leaves, x, y, w, h))
+
+        rects = numpy.empty((len(leaves), 4), numpy.int64)
+        for i, column in enumerate((x, y, w, h)):
+            rects[:, i] = column
+        packed = numpy.frombuffer(self._colours, numpy.uint32)[leaves]
+        colours = numpy.empty((len(leaves), 3), numpy.uint8)
+        for i in range(3):
+            colours[:, i] = packed >> (16 - 8 * i)
+        return rects, colours, leaves
+
+    def expand_visible(self: CompactTree, rect: Tuple[int, int, int, int],
+                       min_side: int = 4,
+                       clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> bool:
+        """Return False: a CompactTree is always complete."""
+        return False
+
+    def coordinate_to_tree(self: CompactTree, coordinates: Tuple[int, int],
+                           rect: Tuple[int, int, int, int],
+                           clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> Optional[CompactNode]:
+        """Return the leaf drawn at <coordinates> when this tree is drawn in
+        <rect>, or None if there is none.
+
+        Only the children of the nodes on the way down to the leaf are laid
+        out, so the work does not depend on <rect> or <clip>, which is only
+        taken for the same calls as AbstractTree.coordinate_to_tree.
+        """
+        if self.is_empty() or self._sizes[0] == 0 \
+                or not coordinates_in_range(rect, coordinates):
+            return None
+
+        index, r = 0, rect
+        while self.children(index):
+            for child, child_rect in zip(self.children(index),
+                                         self._child_rects(index, r)):
+                if self._sizes[child] > 0 \
+                        and coordinates_in_range(child_rect, coordinates):
+                    index, r = child, child_rect
+                    break
+            else:
+                return None
+        return CompactNode(self, index)
+
+    def path(self: CompactTree, index: int) -> str:
+        """Return the path from the root to node <index>, followed by its
+        size, in the same form as AbstractTree.path.
+        """
+        size = self._sizes[index]
+        names = []
+        while index != -1:
+            names.append(self.name(index))
+            index = self._parents[index]
+        names.reverse()
+        return self._separator.join(names) + ' ({})'.format(size)
+
+    def delete_item(self: CompactTree, item: Any) -> bool:
+        """Delete the first leaf named <item>, in preorder, and reduce the
+        size of its ancestors.
+
+        Return True if <item> was deleted, and False otherwise.
+        """
+        for index in range(len(self._sizes)):
+            if not self._removed[index] and self.name(index) == str(item) \
+                    and not self.children(index):
+                self.delete_node(index)
+                return True
+        return False
+
+    def delete_node(self: CompactTree, index: int) -> None:
+        """Delete the leaf <index> and reduce the size of its ancestors.
+
+        Precondition: node <index> is a leaf that has not been deleted.
+        """
+        self.reduce_size(index, self._sizes[index])
+        self._sizes[index] = 0
+        self._removed[index] = 1
+        self._count -= 1
+
+    def reduce_size(self: CompactTree, index: int, data: int) -> None:
+        """Reduce the size of every ancestor of node <index> by <data>."""
+        index = self._parents[index]
+        while index != -1:
+            self._sizes[index] -= data
+            index = self._parents[index]
+
+    def increase_decrease(self: CompactTree, index: int,
+                          increase: bool) -> int:
+        """Grow or shrink the size of node <index> by 1%, as
+        AbstractTree.increase_decrease does, and return the change.
+        """
+        change = math.ceil(self._sizes[index] * 0.01)
+        if increase:
+            self._sizes[index] += change
+            return change
+        if self._sizes[index] - change >= 1:
+            self._sizes[index] -= change
+            return change
+        return 0
+
+    def increase_decrease_parent(self: CompactTree, index: int, size: int,
+                                 increase: bool) -> None:
+        """Grow or shrink the size of every ancestor of node <index> by
+        <size>, according to <increase>.
+        """
+        self.reduce_size(index, -size if increase else size)
+
+    def apply_size_deltas(self: CompactTree, deltas: Dict[int, int]) \
+            -> None:
+        """Add each change in <deltas> to the size of its node and of every
+        ancestor, as AbstractTree.apply_size_deltas does.
+
+        Raise ValueError, and change nothing, if any size would become
+        negative.
+        """
+        parents = self._parents
+        totals = dict(deltas)
+        for index in deltas:
+            parent = parents[index]
+            while parent != -1 and parent not in totals:
+                totals[parent] = 0
+                parent = parents[parent]
+
+        # Nodes are numbered in preorder, so every node comes after its
+        # ancestors.
+        order = sorted(totals, reverse=True)
+        for index in order:
+            if parents[index] != -1:
+                totals[parents[index]] += totals[index]
+
+        sizes = self._sizes
+        if any(sizes[index] + totals[index] < 0 for index in order):
+            raise ValueError('a size would become negative')
+        for index in order:
+            sizes[index] += totals[index]
+
+    def mouse_right(self: CompactTree, coordinate: Tuple[int, int],
+                    rect: Tuple[int, int, int, int],
+                    clip: Optional[Tuple[int, int, int, int]] = None) -> None:
+        """Delete the leaf drawn at <coordinate> when this tree is drawn in
+        <rect>, if there is one.
+        """
+        leaf = self.coordinate_to_tree(coordinate, rect, clip)
+        if leaf is not None:
+            self.delete_node(leaf.index)
+
+
+def save_compact(tree: Union[AbstractTree, CompactTree], path: str) -> None:
+    """Write <tree> to a binary snapshot file at <path>.
+
+    An AbstractTree is converted to a CompactTree first.
+    """
+    if isinstance(tree, AbstractTree):
+        tree = CompactTree(tree)
+
+    separator = tree._separator.encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _ORDER, len(tree._sizes),
+                             len(tree._children), len(tree._names),
+                             len(separator), tree._count))
+        _write_aligned(f, separator)
+        for attribute, _, _ in _SECTIONS:
+            _write_aligned(f, getattr(tree, attribute))
+
+
+def load_compact(path: str, shared: bool = False) -> CompactTree:
+    """Return the CompactTree saved in the snapshot file at <path>.
+
+    The file is mapped into memory rather than read: each array of the
+    result is a view of its section of the file, and a page of the file is
+    only read when something in it is used. Changes to the tree stay in
+    memory and are never written back to the file, unless <shared> is True.
+    Then changes to the sizes and deletions are written to the file, and
+    seen by every other process that has loaded it with <shared> True.
+
+    Raise ValueError if <path> is not a snapshot written on a machine with
+    the same byte order.
+    """
+    with open(path, 'r+b' if shared else 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE
+                           if shared else mmap.ACCESS_COPY)
+
+    if len(mapped) < _HEADER.size:
+        raise ValueError('{} is not a treemap snapshot'.format(path))
+    magic, order, nodes, children, names, separator, live = \
+        _HEADER.unpack_from(mapped)
+    if magic != _MAGIC:
+        raise ValueError('{} is not a treemap snapshot'.format(path))
+    if order != _ORDER:
+        raise ValueError('{} was written with a different byte order'
+                         .format(path))
+
+    view = memoryview(mapped)
+    offset = _HEADER.size
+    tree = CompactTree()
+    tree._separator = str(view[offset:offset + separator], 'utf-8')
+    tree._count = live
+    offset = _aligned(offset + separator)
+
+    lengths = {'nodes': nodes, 'nodes + 1': nodes + 1,
+               'children': children, 'names': names}
+    for attribute, code, length in _SECTIONS:
+        end = offset + lengths[length] * struct.calcsize(code)
+        setattr(tree, attribute, view[offset:end].cast(code))
+        offset = _aligned(end)
+
+    return tree
+
+
+def _aligned(offset: int) -> int:
+    """Return the first multiple of 8 that is at least <offset>."""
+    return (offset + 7) // 8 * 8
+
+
+def _write_aligned(f: Any, data: Any) -> None:
+    """Write the bytes of the buffer <data> to the file <f>, followed by
+    zeros up to the next multiple of 8 bytes.
+    """
+    data = memoryview(data).cast('B')
+    f.write(data)
+    f.write(bytes(_aligned(len(data)) - len(data)))
+
+
+class CompactNode:
+    """One node of a CompactTree, with the methods the treemap visualiser
+    calls on a selected leaf.
+
+    === Public Attributes ===
+    tree: the CompactTree this node belongs to.
+    index: the index of this node in <tree>.
+    """
+    tree: CompactTree
+    index: int
+
+    def __init__(self: CompactNode, tree: CompactTree, index: int) -> None:
+        """Initialize a handle on node <index> of <tree>."""
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self: CompactNode, other: Any) -> bool:
+        """Return True iff <other> is a handle on the same node."""
+        return isinstance(other, CompactNode) and other.tree is self.tree \
+            and other.index == self.index
+
+    def __hash__(self: CompactNode) -> int:
+        """Return a hash consistent with __eq__."""
+        return hash((id(self.tree), self.index))
+
+    @property
+    def data_size(self: CompactNode) -> int:
+        """The size of this node."""
+        return self.tree._sizes[self.index]
+
+    def path(self: CompactNode) -> str:
+        """Return the path from the root to this node, with its size."""
+        return self.tree.path(self.index)
+
+    def increase_decrease(self: CompactNode, increase: bool) -> int:
+        """Grow or shrink this node by 1% and return the change."""
+        return self.tree.increase_decrease(self.index, increase)
+
+    def increase_decrease_parent(self: CompactNode, size: int,
+                                 increase: bool) -> None:
+        """Grow or shrink every ancestor of this node by <size>."""
+        self.tree.increase_decrease_parent(self.index, size, increase)
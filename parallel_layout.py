@@ -0,0 +1,249 @@
+"""Lay out large trees on several cores at once.
+
+Once a node's rectangle is known, the layout of each of its subtrees is
+independent of the others. A ParallelLayout lays out the top few levels of a
+CompactTree itself, until there are a few subtrees per worker, then hands
+those subtrees to a pool of processes and joins their rectangles in drawing
+order.
+
+The workers do not receive the tree. It is saved to a temporary snapshot
+file that each worker maps into memory with load_compact, so a task is only
+a node index and a rectangle, and a result is only arrays of rectangles.
+On builds of Python without a global interpreter lock, threads that share
+the tree are used instead.
+"""
+from __future__ import annotations
+import os
+import sys
+import tempfile
+from array import array
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+
+from typing import Tuple, List, Optional, Any, Union
+
+from tree_data import AbstractTree
+from compact_tree import CompactTree, save_compact, load_compact, numpy
+
+# The number of subtrees each worker is given, so that a few large subtrees
+# do not leave the other workers idle.
+TASKS_PER_WORKER = 4
+
+# The tree a worker process lays out, loaded by _open_snapshot.
+_TREE = None
+
+
+class ParallelLayout:
+    """Lays out a CompactTree with a pool of workers.
+
+    Change the tree only through the <tree> attribute, so the workers see
+    the changes. Call close when the layout is no longer needed.
+
+    === Public Attributes ===
+    tree: the tree that is laid out.
+
+    === Private Attributes ===
+    _path: the snapshot file the workers map, or None if the workers are
+        threads.
+    _executor: the pool of workers.
+    _tasks: the number of subtrees to split a layout into.
+    """
+    tree: CompactTree
+    _path: Optional[str]
+    _executor: Executor
+    _tasks: int
+
+    def __init__(self: ParallelLayout,
+                 tree: Union[AbstractTree, CompactTree],
+                 workers: Optional[int] = None) -> None:
+        """Initialize a layout of <tree> on <workers> workers, or one per
+        core if <workers> is None.
+
+        An AbstractTree is converted to a CompactTree first.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self._tasks = workers * TASKS_PER_WORKER
+
+        if not getattr(sys, '_is_gil_enabled', lambda: True)():
+            self.tree = tree if isinstance(tree, CompactTree) \
+                else CompactTree(tree)
+            self._path = None
+            self._executor = ThreadPoolExecutor(workers)
+            return
+
+        fd, self._path = tempfile.mkstemp(suffix='.tmap')
+        os.close(fd)
+        save_compact(tree, self._path)
+        self.tree = load_compact(self._path, shared=True)
+        self._executor = ProcessPoolExecutor(
+            workers, initializer=_open_snapshot, initargs=(self._path,))
+
+    def close(self: ParallelLayout) -> None:
+        """Stop the workers and delete the snapshot file.
+
+        The tree can still be used, but not laid out by this object.
+        """
+        self._executor.shutdown()
+        if self._path is not None:
+            os.remove(self._path)
+
+    def generate_treemap(self: ParallelLayout,
+                         rect: Tuple[int, int, int, int],
+                         min_side: int = 0) \
+            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+        """Return the rectangles of CompactTree.generate_treemap(rect,
+        min_side), laid out by the workers.
+        """
+        if numpy is not None:
+            rects, colours, _ = self.layout_arrays(rect, min_side)
+            return list(zip(map(tuple, rects.tolist()),
+                            map(tuple, colours.tolist())))
+
+        result = []
+        colour = self.tree.colour
+        for part in self._run(rect, min_side, False):
+            values = iter(part)
+            for x, y, w, h, index in zip(values, values, values, values,
+                                         values):
+                result.append(((x, y, w, h), colour(index)))
+        return result
+
+    def layout_arrays(self: ParallelLayout, rect: Tuple[int, int, int, int],
+                      min_side: int = 0) -> Tuple[Any, Any, Any]:
+        """Return the arrays of CompactTree.layout_arrays(rect, min_side),
+        laid out by the workers.
+
+        Raise ImportError if NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('layout_arrays requires NumPy')
+
+        parts = self._run(rect, min_side, True)
+        if not parts:
+            return self.tree.layout_arrays(rect, min_side)
+        rects = numpy.concatenate([part[0] for part in parts])
+        colours = numpy.concatenate([part[1] for part in parts])
+        leaves = numpy.concatenate([part[2] for part in parts])
+        return rects, colours, leaves
+
+    def _run(self: ParallelLayout, rect: Tuple[int, int, int, int],
+             min_side: int, arrays: bool) -> List:
+        """Return the layout of the tree in <rect> as a list of parts in
+        drawing order, each the result of layout_arrays if <arrays> is True,
+        or an array of x, y, width, height and index for each rectangle
+        otherwise.
+        """
+        tree = self.tree
+        parts = []
+        # The (rectangle, index) pairs of the nodes since the last split one,
+        # which are drawn as they are.
+        drawn = []
+        for index, r, split in self._split(rect, min_side):
+            if not split:
+                drawn.append((r, index))
+                continue
+            if drawn:
+                parts.append(self._drawn(drawn, arrays))
+                drawn = []
+            parts.append(self._executor.submit(
+                _lay_out, tree if self._path is None else None, index, r,
+                min_side, tree._count, arrays))
+        if drawn:
+            parts.append(self._drawn(drawn, arrays))
+
+        return [part.result() if isinstance(part, Future) else part
+                for part in parts]
+
+    def _drawn(self: ParallelLayout,
+               pairs: List[Tuple[Tuple[int, int, int, int], int]],
+               arrays: bool) -> Any:
+        """Return the (rectangle, index) <pairs> in the form of a part of
+        the result of _run.
+        """
+        if not arrays:
+            return _flatten(pairs)
+        return (numpy.array([r for r, _ in pairs], numpy.int64),
+                numpy.array([self.tree.colour(index) for _, index in pairs],
+                            numpy.uint8),
+                numpy.array([index for _, index in pairs], numpy.int64))
+
+    def _split(self: ParallelLayout, rect: Tuple[int, int, int, int],
+               min_side: int) \
+            -> List[Tuple[int, Tuple[int, int, int, int], bool]]:
+        """Return (index, rectangle, split) for the nodes that make up the
+        layout of the tree in <rect>, in drawing order.
+
+        A node is split if it is the root of a subtree that a worker should
+        lay out. Otherwise it is drawn as a single rectangle. The levels of
+        the tree are laid out one at a time until there are at least _tasks
+        split nodes.
+        """
+        tree = self.tree
+        if tree.is_empty():
+            return []
+
+        nodes = [(0, rect, _classify(tree, 0, rect, min_side))]
+        while 0 < sum(1 for node in nodes if node[2]) < self._tasks:
+            level = []
+            for index, r, split in nodes:
+                if not split:
+                    level.append((index, r, split))
+                    continue
+                for child, child_rect in zip(tree.children(index),
+                                             tree._child_rects(index, r)):
+                    level.append((child, child_rect, _classify(
+                        tree, child, child_rect, min_side)))
+            nodes = level
+
+        return [node for node in nodes if node[2] is not None]
+
+
+def _classify(tree: CompactTree, index: int,
+              rect: Tuple[int, int, int, int],
+              min_side: int) -> Optional[bool]:
+    """Return None if node <index> of <tree> is not drawn in <rect>, False
+    if it is drawn as one rectangle and True if it is subdivided, following
+    the rules of CompactTree._layout.
+    """
+    if tree._sizes[index] == 0:
+        return None
+    culled = min_side > 0 and min(rect[2], rect[3]) < min_side
+    if culled and (rect[2] <= 0 or rect[3] <= 0):
+        return None
+    return not culled and bool(tree.children(index))
+
+
+def _open_snapshot(path: str) -> None:
+    """Load the tree in the snapshot file <path> for this worker process."""
+    global _TREE
+    _TREE = load_compact(path, shared=True)
+
+
+def _lay_out(tree: Optional[CompactTree], index: int,
+             rect: Tuple[int, int, int, int], min_side: int, count: int,
+             arrays: bool) -> Any:
+    """Lay out the subtree rooted at node <index> of <tree>, or of this
+    worker's tree if <tree> is None, in <rect>.
+
+    <count> is the number of nodes of the tree that have not been deleted,
+    which a worker process cannot see in its snapshot.
+    """
+    if tree is None:
+        tree = _TREE
+        tree._count = count
+    if arrays:
+        return tree.layout_arrays(rect, min_side, index)
+    return _flatten(tree._layout(rect, min_side, index))
+
+
+def _flatten(pairs: List[Tuple[Tuple[int, int, int, int], int]]) -> array:
+    """Return an array of the x, y, width, height and index of each
+    (rectangle, index) pair in <pairs>, which is much quicker to send
+    between processes than the pairs.
+    """
+    values = array('q')
+    for r, index in pairs:
+        values.extend(r)
+        values.append(index)
+    return values
@@ -0,0 +1,884 @@
+"""Fast scanners that build FileSystemTree objects.
+
+FileSystemTree(path) walks the disk on a single thread and calls
+os.path.isdir, os.listdir and os.path.getsize separately for every entry.
+The scanners in this module use os.scandir instead, so the type of each
+entry comes for free from the directory listing and its size costs at most
+one stat, and they spread the directory listing across a thread pool.
+"""
+from __future__ import annotations
+import os
+import re
+import math
+import random
+import json
+import threading
+from queue import Queue
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from typing import Tuple, List, Dict, Any, Callable, Iterator, Optional, \
+    Sequence, Pattern
+
+from tree_data import FileSystemTree
+
+# The number of threads used to list directories when none is given.
+# Listing is bound by system calls rather than the interpreter, so this is
+# more than the number of cores.
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# A directory listing: one (name, is_dir, size) tuple per entry, in the
+# order os.scandir reported them. The size of a directory entry is 0.
+Listing = List[Tuple[str, bool, int]]
+
+# How a scan was made, for the CoalescedItems leaves it builds: the function
+# that lists each directory under the scan's rules, and the scan's min_size
+# and max_children.
+ScanOptions = Tuple[Callable[[str], Tuple[Listing, List[str]]], int,
+                    Optional[int]]
+
+# A snapshot entry for one directory: its mtime in nanoseconds, its inode
+# number and its listing.
+Stamped = Tuple[int, int, Listing]
+
+
+def scan_file_system(path: str, workers: int = DEFAULT_WORKERS,
+                     min_size: int = 0,
+                     max_children: Optional[int] = None,
+                     rules: Optional[ScanRules] = None,
+                     sampler: Optional[SizeSampler] = None) -> FileSystemTree:
+    """Return the FileSystemTree for the file or folder at <path>.
+
+    The result has the same structure as FileSystemTree(path), but the
+    directories are listed with os.scandir by a pool of <workers> threads.
+
+    If <min_size> or <max_children> is given, the files and folders of each
+    directory that are smaller than <min_size> bytes, or that are not among
+    its <max_children> largest, are merged into one CoalescedItems leaf;
+    see build_tree.
+
+    If <rules> is given, the files and folders it excludes are skipped
+    before they are stat'ed or listed; see ScanRules.
+
+    If <sampler> is given, the files of directories with too many of them
+    are not all stat'ed. Instead, their total size is estimated from a
+    sample and they are represented by one EstimatedItems leaf; see
+    SizeSampler and refine_estimates.
+
+    Precondition: <path> is a valid path for this computer, workers >= 1
+    and max_children is None or at least 1.
+    """
+    if not os.path.isdir(path):
+        return FileSystemTree(None, os.path.basename(path), [],
+                              os.path.getsize(path))
+
+    listings = dict(walk(path, _visitor(path, rules, sampler), workers))
+    return build_tree(path, listings, min_size, max_children,
+                      None if sampler is None else sampler.estimates,
+                      _visitor(path, rules, None))
+
+
+def scan_lazy(path: str, workers: int = DEFAULT_WORKERS) -> FileSystemTree:
+    """Return a FileSystemTree for the file or folder at <path> whose
+    folders are only built when expand is called on them.
+
+    The root is expanded straight away. The size of every folder comes from
+    an aggregate pass that keeps one number per folder instead of one node
+    per file; see LazyFileSystemTree.
+
+    Precondition: <path> is a valid path for this computer and workers >= 1.
+    """
+    if not os.path.isdir(path):
+        return scan_file_system(path)
+
+    results = dict(walk(path, _directory_bytes, workers))
+    dir_sizes = {}
+    for directory in reversed(results):
+        own, subdirs = results[directory]
+        dir_sizes[directory] = own + sum(dir_sizes[subdir]
+                                         for subdir in subdirs)
+
+    root = LazyFileSystemTree(path, dir_sizes)
+    root.expand()
+    return root
+
+
+def scan_streaming(path: str, updates: Queue,
+                   workers: int = DEFAULT_WORKERS,
+                   rules: Optional[ScanRules] = None) -> FileSystemTree:
+    """Return a FileSystemTree for the file or folder at <path> that is
+    filled in while the scan runs.
+
+    The folder <path> starts out empty. A background thread lists the
+    directories below it and puts one callable on <updates> per directory;
+    calling it attaches that directory's files and folders to the tree and
+    grows the data_size of their parents. The callables must be run in
+    order, on the thread that owns the tree, as event_loop does.
+
+    If the scan fails, the callable for the failing directory raises the
+    error instead. <rules> is used as in scan_file_system.
+
+    Precondition: <path> is a valid path for this computer and workers >= 1.
+    """
+    if not os.path.isdir(path):
+        return scan_file_system(path)
+
+    root = FileSystemTree(None, os.path.basename(path))
+    folders = {path: root}
+    visit = _visitor(path, rules, None)
+
+    def produce() -> None:
+        """Publish every directory listing of the scan to <updates>."""
+        try:
+            for directory, listing in walk(path, visit, workers):
+                updates.put(partial(_attach_listing, folders, directory,
+                                    listing))
+        except OSError as error:
+            updates.put(partial(_raise, error))
+
+    threading.Thread(target=produce, daemon=True).start()
+    return root
+
+
+def _attach_listing(folders: Dict[str, FileSystemTree], directory: str,
+                    listing: Listing) -> None:
+    """Add the entries of <listing> to the folder for <directory>.
+
+    <folders> holds the folders that have not been listed yet, by full path.
+    """
+    folder = folders.pop(directory)
+    subtrees = []
+
+    for name, is_dir, size in listing:
+        if is_dir:
+            subtree = FileSystemTree(None, name)
+            folders[os.path.join(directory, name)] = subtree
+        else:
+            subtree = FileSystemTree(None, name, [], size)
+        subtrees.append(subtree)
+
+    folder.add_subtrees(subtrees)
+
+
+def _raise(error: Exception) -> None:
+    """Raise <error>; used to report a failure across threads."""
+    raise error
+
+
+def scan_with_snapshot(path: str, snapshot_path: str,
+                       workers: int = DEFAULT_WORKERS) -> FileSystemTree:
+    """Return the FileSystemTree for the file or folder at <path>, reusing
+    the scan saved in <snapshot_path> by an earlier call, and save the new
+    scan there.
+
+    Only directories whose mtime or inode changed since the snapshot are
+    listed again; every other directory costs a single stat and keeps its
+    stored listing. The tree is then built from the listings, so data_size
+    is correct along every changed path.
+
+    A file that was modified in place without its directory changing keeps
+    its stored size until something else in that directory changes.
+
+    Precondition: <path> is a valid path for this computer and workers >= 1.
+    """
+    if not os.path.isdir(path):
+        return scan_file_system(path)
+
+    previous = load_snapshot(snapshot_path, path)
+    stamped = dict(walk(path, partial(_rescan_directory, previous=previous),
+                        workers))
+    save_snapshot(snapshot_path, path, stamped)
+
+    return build_tree(path, {directory: stamped[directory][2]
+                             for directory in stamped})
+
+
+def load_snapshot(snapshot_path: str, path: str) -> Dict[str, Stamped]:
+    """Return the directories saved in <snapshot_path> for a scan of <path>.
+
+    Return an empty dictionary if there is no readable snapshot of <path>,
+    or if the snapshot is not in the form save_snapshot writes.
+    """
+    try:
+        with open(snapshot_path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(snapshot, dict) or snapshot.get('root') != path:
+        return {}
+
+    try:
+        return {directory: (mtime, ino, [(name, is_dir, size)
+                                         for name, is_dir, size in listing])
+                for directory, (mtime, ino, listing)
+                in snapshot['directories'].items()}
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return {}
+
+
+def save_snapshot(snapshot_path: str, path: str,
+                  stamped: Dict[str, Stamped]) -> None:
+    """Write the directories of a scan of <path> to <snapshot_path>.
+
+    The file is replaced atomically, so an interrupted save leaves the old
+    snapshot in place.
+    """
+    temporary = snapshot_path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'root': path, 'directories': stamped}, f)
+    os.replace(temporary, snapshot_path)
+
+
+def _rescan_directory(path: str, previous: Dict[str, Stamped]) \
+        -> Tuple[Stamped, List[str]]:
+    """Return the snapshot entry of the directory <path> and the paths of its
+    subdirectories, listing it again only if it changed since <previous>.
+    """
+    stat = os.stat(path)
+    old = previous.get(path)
+
+    if old is not None and old[0] == stat.st_mtime_ns \
+            and old[1] == stat.st_ino:
+        listing = old[2]
+        subdirs = [os.path.join(path, name)
+                   for name, is_dir, _ in listing if is_dir]
+    else:
+        listing, subdirs = list_directory(path)
+
+    return (stat.st_mtime_ns, stat.st_ino, listing), subdirs
+
+
+def _directory_bytes(path: str) -> Tuple[Tuple[int, List[str]], List[str]]:
+    """Return the total size of the files directly inside the directory
+    <path> along with the paths of its subdirectories, and those paths again
+    as the subdirectories to visit.
+    """
+    total = 0
+    subdirs = []
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            else:
+                total += entry.stat().st_size
+
+    return (total, subdirs), subdirs
+
+
+def list_directory(path: str, rules: Optional[ScanRules] = None,
+                   root: str = '', device: int = 0,
+                   sampler: Optional[SizeSampler] = None) \
+        -> Tuple[Listing, List[str]]:
+    """Return the listing of the directory <path> and the paths of its
+    subdirectories.
+
+    Directory symlinks are followed, as os.path.isdir does.
+
+    If <rules> is given, <path> is part of a scan of the directory <root>,
+    which is on the device <device>. Files that <rules> excludes are left
+    out, and folders that it prunes are listed as files, which are not
+    visited; see ScanRules.
+
+    If <sampler> is given and decides to estimate the size of the files in
+    <path>, they are left out of the listing and only a sample of them is
+    stat'ed; see SizeSampler.
+    """
+    listing = []
+    subdirs = []
+
+    if rules is not None:
+        prefix = _relative_prefix(path, root)
+        depth = prefix.count('/') + 1
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            is_dir = entry.is_dir()
+
+            if rules is not None and is_dir and rules.prunes(
+                    prefix + entry.name, entry, depth, device):
+                listing.append((entry.name, False,
+                                rules.pruned_size(entry.path)))
+            elif rules is not None and not is_dir \
+                    and rules.excludes(prefix + entry.name, False):
+                continue
+            elif is_dir:
+                listing.append((entry.name, True, 0))
+                subdirs.append(entry.path)
+            elif sampler is None:
+                listing.append((entry.name, False, entry.stat().st_size))
+            else:
+                # Hold the entry until we know whether to stat it.
+                listing.append(entry)
+
+    if sampler is not None:
+        files = [item for item in listing if isinstance(item, os.DirEntry)]
+        if files and sampler.sample(path, files):
+            listing = [item for item in listing
+                       if not isinstance(item, os.DirEntry)]
+        else:
+            listing = [(item.name, False, item.stat().st_size)
+                       if isinstance(item, os.DirEntry) else item
+                       for item in listing]
+
+    return listing, subdirs
+
+
+def _relative_prefix(path: str, root: str) -> str:
+    """Return the path of <path> relative to <root> as ScanRules matches it,
+    with a trailing '/' unless it is <root> itself.
+    """
+    relative = os.path.relpath(path, root).replace(os.sep, '/')
+    return '' if relative == '.' else relative + '/'
+
+
+def _visitor(path: str, rules: Optional[ScanRules],
+             sampler: Optional[SizeSampler]) \
+        -> Callable[[str], Tuple[Listing, List[str]]]:
+    """Return the function walk should call to list each directory of a scan
+    of <path> that follows <rules> and <sampler>.
+    """
+    if rules is None and sampler is None:
+        return list_directory
+    device = os.stat(path).st_dev if rules is not None else 0
+    return partial(list_directory, rules=rules, root=path, device=device,
+                   sampler=sampler)
+
+
+def refine_estimates(tree: FileSystemTree, updates: Queue,
+                     path: str = '', rules: Optional[ScanRules] = None) \
+        -> threading.Thread:
+    """Start a background thread that works out the exact size of every
+    EstimatedItems leaf in <tree>, and return it.
+
+    Each exact size is published to <updates> as a callable that settles the
+    leaf, in the same way as scan_streaming publishes its listings.
+
+    If <rules> is given, <tree> was scanned from <path> following them, and
+    the files they exclude are left out of each exact size, as they were
+    left out of the estimate.
+    """
+    estimated = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, EstimatedItems):
+            estimated.append(node)
+        stack.extend(node._subtrees)
+
+    def produce() -> None:
+        """Publish the exact size of each estimated leaf."""
+        for node in estimated:
+            if rules is not None:
+                prefix = _relative_prefix(node._path, path)
+            try:
+                with os.scandir(node._path) as entries:
+                    size = sum(entry.stat().st_size for entry in entries
+                               if not entry.is_dir()
+                               and (rules is None or not rules.excludes(
+                                   prefix + entry.name, False)))
+            except OSError:
+                continue
+            updates.put(partial(node.settle, size))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    return thread
+
+
+def walk(path: str, visit: Callable[[str], Tuple[Any, List[str]]],
+         workers: int) -> Iterator[Tuple[str, Any]]:
+    """Yield a (directory, result) pair for <path> and each directory below it.
+
+    <visit> is called on every directory by a pool of <workers> threads and
+    returns its result along with the subdirectories that should be visited
+    next. Pairs are yielded as soon as they are ready, so the order between
+    siblings is not fixed, but a directory is always yielded before any of
+    its subdirectories.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(visit, path): path}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                directory = pending.pop(future)
+                result, subdirs = future.result()
+
+                for subdir in subdirs:
+                    pending[pool.submit(visit, subdir)] = subdir
+
+                yield directory, result
+
+
+def build_tree(path: str, listings: Dict[str, Listing], min_size: int = 0,
+               max_children: Optional[int] = None,
+               estimates: Optional[Dict[str, Tuple[int, int, int]]] = None,
+               visit: Callable[[str], Tuple[Listing, List[str]]]
+               = list_directory) -> FileSystemTree:
+    """Return the FileSystemTree for the directory <path> using the listings
+    of <path> and every directory below it.
+
+    <listings> must be ordered parent before child, as walk yields them. The
+    tree is built bottom-up without recursion, so deep trees are fine, and
+    each listing is dropped from <listings> once it has been used.
+
+    Within each directory, the items smaller than <min_size> bytes and the
+    items beyond the <max_children> largest are merged into a single
+    CoalescedItems leaf at the end of its subtrees, as long as there are at
+    least two of them. Their subtrees are never kept, which is where the
+    memory saving comes from.
+
+    <estimates> gives the (count, estimate, error) of the files left out of
+    the listing of each sampled directory, which get one EstimatedItems
+    leaf at the very end of that directory's subtrees.
+
+    <visit> is the function the listings were made with, minus any
+    sampling. The CoalescedItems and EstimatedItems leaves list their
+    directory with it when they are split, so the same rules apply.
+    """
+    built = {}
+    options = (visit, min_size, max_children)
+
+    for directory in list(reversed(listings)):
+        subtrees = []
+
+        for name, is_dir, size in listings.pop(directory):
+            if is_dir:
+                subtrees.append(built.pop(os.path.join(directory, name)))
+            else:
+                subtrees.append(FileSystemTree(None, name, [], size))
+
+        if min_size > 0 or max_children is not None:
+            subtrees = _coalesce(directory, subtrees, options)
+
+        if estimates is not None and directory in estimates:
+            subtrees.append(EstimatedItems(directory, *estimates[directory],
+                                           options=options))
+
+        built[directory] = FileSystemTree(None, os.path.basename(directory),
+                                          subtrees)
+
+    return built[path]
+
+
+def _coalesce(directory: str, subtrees: List[FileSystemTree],
+              options: ScanOptions) -> List[FileSystemTree]:
+    """Return <subtrees> with the items that are smaller than the min_size
+    or not among the max_children largest of <options> merged into a
+    CoalescedItems leaf.
+
+    <subtrees> is returned unchanged if fewer than two items would be merged.
+    """
+    _, min_size, max_children = options
+    kept = [subtree for subtree in subtrees if subtree.data_size >= min_size]
+
+    if max_children is not None and len(kept) > max_children:
+        largest = sorted(kept, key=lambda subtree: subtree.data_size,
+                         reverse=True)[:max_children]
+        ids = {id(subtree) for subtree in largest}
+        kept = [subtree for subtree in kept if id(subtree) in ids]
+
+    merged = len(subtrees) - len(kept)
+    if merged < 2:
+        return subtrees
+
+    size = sum(subtree.data_size for subtree in subtrees) \
+        - sum(subtree.data_size for subtree in kept)
+    kept.append(CoalescedItems(directory, merged, size, options))
+    return kept
+
+
+class ScanRules:
+    """Which files and folders a scan leaves out.
+
+    Excluded files are skipped entirely. Pruned folders are never listed:
+    each one appears in the tree as a single leaf, whose data_size is 0 or,
+    if asked for, the total size of everything below it.
+
+    A folder is pruned if it is excluded, if it is more than <max_depth>
+    levels below the root of the scan, or, if <one_file_system> is set, if
+    it is on a different device from the root.
+
+    Exclusions are written like the lines of a .gitignore file, matched
+    against paths relative to the root of the scan, with / as separator:
+    - a pattern without a / other than at its end matches a name at any
+      level, and one with a / matches from the root;
+    - * and ? match anything but /, and ** matches any number of folders;
+    - a trailing / only matches folders;
+    - a leading ! includes again what an earlier pattern excluded.
+    The last pattern that matches a path decides.
+
+    === Public Attributes ===
+    max_depth: how many levels of folders below the root are listed, or
+        None for no limit. With 0, only the root itself is listed.
+    one_file_system: whether folders on other devices are pruned.
+    size_pruned: whether pruned folders are sized like du would.
+
+    === Private Attributes ===
+    _patterns: each pattern as a regular expression, whether it includes
+        rather than excludes, and whether it only matches folders.
+    """
+    max_depth: Optional[int]
+    one_file_system: bool
+    size_pruned: bool
+    _patterns: List[Tuple[Pattern, bool, bool]]
+
+    def __init__(self: ScanRules, patterns: Sequence[str] = (),
+                 max_depth: Optional[int] = None,
+                 one_file_system: bool = False,
+                 size_pruned: bool = False) -> None:
+        """Initialize rules with the exclusion <patterns> and options."""
+        self.max_depth = max_depth
+        self.one_file_system = one_file_system
+        self.size_pruned = size_pruned
+        self._patterns = [_compile_pattern(pattern) for pattern in patterns
+                          if pattern.strip() and not pattern.startswith('#')]
+
+    def excludes(self: ScanRules, relative: str, is_dir: bool) -> bool:
+        """Return True iff the patterns exclude the file or folder at the
+        /-separated path <relative>.
+        """
+        excluded = False
+        for regex, negated, dir_only in self._patterns:
+            if (is_dir or not dir_only) and regex.match(relative):
+                excluded = not negated
+        return excluded
+
+    def prunes(self: ScanRules, relative: str, entry: os.DirEntry,
+               depth: int, device: int) -> bool:
+        """Return True iff the folder <entry>, found at <relative>, <depth>
+        levels below a root on <device>, should not be listed.
+        """
+        if self.excludes(relative, True):
+            return True
+        if self.max_depth is not None and depth > self.max_depth:
+            return True
+        return self.one_file_system and entry.stat().st_dev != device
+
+    def pruned_size(self: ScanRules, path: str) -> int:
+        """Return the data_size of the leaf for the pruned folder <path>."""
+        if not self.size_pruned:
+            return 0
+
+        total = 0
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        return total
+
+
+def _compile_pattern(pattern: str) -> Tuple[Pattern, bool, bool]:
+    """Return the .gitignore style <pattern> as a regular expression, along
+    with whether it is negated and whether it only matches folders.
+    """
+    negated = pattern.startswith('!')
+    pattern = pattern[1:] if negated else pattern
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    regex = '' if anchored else '(?:.*/)?'
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            members = pattern[i + 1:end]
+            if members.startswith('!'):
+                members = '^' + members[1:]
+            regex += '[' + members.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+
+    return re.compile(regex + r'\Z'), negated, dir_only
+
+
+class SizeSampler:
+    """Estimates the total size of the files of huge directories from a
+    random sample of them, so that only the sample has to be stat'ed.
+
+    The estimate comes with an error bound: the half-width of an
+    approximately 95% confidence interval for the total.
+
+    === Public Attributes ===
+    threshold: directories with more files than this are sampled.
+    sample_size: the number of files stat'ed in each sampled directory.
+    estimates: the (count, estimate, error) of the files of each sampled
+        directory so far, by path.
+
+    === Private Attributes ===
+    _random: the source of the samples.
+    """
+    threshold: int
+    sample_size: int
+    estimates: Dict[str, Tuple[int, int, int]]
+    _random: random.Random
+
+    def __init__(self: SizeSampler, threshold: int, sample_size: int = 1000,
+                 seed: Optional[int] = None) -> None:
+        """Initialize a sampler for directories with more than <threshold>
+        files, seeded with <seed>.
+
+        Precondition: 2 <= sample_size <= threshold.
+        """
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self.estimates = {}
+        self._random = random.Random(seed)
+
+    def sample(self: SizeSampler, path: str,
+               files: List[os.DirEntry]) -> bool:
+        """Estimate the total size of <files>, the files of the directory
+        <path>, if there are more than <threshold> of them.
+
+        Return True iff an estimate was recorded.
+        """
+        if len(files) <= self.threshold:
+            return False
+
+        sizes = []
+        for entry in self._random.sample(files, self.sample_size):
+            try:
+                sizes.append(entry.stat().st_size)
+            except OSError:
+                continue
+        if len(sizes) < 2:
+            return False
+
+        count, taken = len(files), len(sizes)
+        mean = sum(sizes) / taken
+        variance = sum((size - mean) ** 2 for size in sizes) / (taken - 1)
+        # The standard error of count * mean, with the finite population
+        # correction since we sample without replacement.
+        error = count * math.sqrt(variance / taken
+                                  * (count - taken) / (count - 1))
+        self.estimates[path] = (count, round(count * mean),
+                                math.ceil(1.96 * error))
+        return True
+
+
+class LazyFileSystemTree(FileSystemTree):
+    """A folder in a FileSystemTree whose subtrees are built on demand.
+
+    Until expand is called, the folder is a leaf whose data_size is the
+    total size of everything below it. Calling expand lists the folder and
+    adds its files and (again lazy) subfolders, so a treemap only pays for
+    the folders that get enough pixels to be subdivided; see
+    AbstractTree.expand_visible.
+
+    === Private Attributes ===
+    _path: the full path of this folder, or None once it has been expanded.
+    _dir_sizes: the total size of the folders of this scan that have not
+        been built yet, by full path. It is shared by every folder of the
+        scan.
+    """
+    _path: Optional[str]
+    _dir_sizes: Dict[str, int]
+
+    def __init__(self: LazyFileSystemTree, path: str,
+                 dir_sizes: Dict[str, int]) -> None:
+        """Initialize an unexpanded folder for the directory <path>.
+
+        A folder that was created after <dir_sizes> was computed starts with
+        a data_size of 0 and is sized properly when it is expanded.
+        """
+        FileSystemTree.__init__(self, None, os.path.basename(path), [],
+                                dir_sizes.pop(path, 0))
+        self._path = path
+        self._dir_sizes = dir_sizes
+
+    def expand(self: LazyFileSystemTree) -> bool:
+        """Build the subtrees of this folder if they have not been built yet.
+
+        Return True iff this folder changed. The data_size of this folder
+        and its parents is corrected to the sizes that were actually listed.
+        """
+        if self._path is None:
+            return False
+
+        listing, _ = list_directory(self._path)
+        subtrees = []
+        for name, is_dir, size in listing:
+            if is_dir:
+                subtrees.append(LazyFileSystemTree(
+                    os.path.join(self._path, name), self._dir_sizes))
+            else:
+                subtrees.append(FileSystemTree(None, name, [], size))
+
+        self._path = None
+        self.reduce_size(self.data_size)
+        self.data_size = 0
+        self.add_subtrees(subtrees)
+        return True
+
+
+class CoalescedItems(FileSystemTree):
+    """A leaf that stands for many small files and folders of one folder.
+
+    Its data_size is their total size. Calling split, or expand, which
+    expand_visible does once the leaf is big enough on screen, replaces it
+    with the items themselves.
+
+    === Private Attributes ===
+    _path: the full path of the folder the items are in.
+    _count: the number of items this leaf stands for.
+    _options: how the folder was scanned, which the items are scanned with
+        when this leaf is split. It is shared by every leaf of the scan.
+    """
+    _path: str
+    _count: int
+    _options: ScanOptions
+
+    def __init__(self: CoalescedItems, path: str, count: int,
+                 data_size: int,
+                 options: ScanOptions = (list_directory, 0, None)) -> None:
+        """Initialize a leaf for <count> items of the folder <path> whose
+        total size is <data_size>, which were scanned with <options>.
+        """
+        FileSystemTree.__init__(self, None, '<{} small items>'.format(count),
+                                [], data_size)
+        self._path = path
+        self._count = count
+        self._options = options
+
+    def split(self: CoalescedItems) -> List[FileSystemTree]:
+        """Replace this leaf in its folder with the items it stands for, and
+        return them.
+
+        The folder is listed again, and every item that is not already one
+        of its subtrees is scanned in full, with the rules, min_size and
+        max_children the folder was scanned with. The data_size of the
+        folder and its parents is corrected to the sizes that were actually
+        scanned.
+
+        Precondition: this leaf is still part of its folder's tree.
+        """
+        visit, min_size, max_children = self._options
+        folder = self._parent_tree
+        present = set()
+        estimated = False
+        for subtree in folder._subtrees:
+            if isinstance(subtree, EstimatedItems):
+                estimated = estimated or subtree._root is not None
+            elif not isinstance(subtree, CoalescedItems):
+                present.add(subtree._root)
+        listing, _ = visit(self._path)
+
+        subtrees = []
+        for name, is_dir, size in listing:
+            path = os.path.join(self._path, name)
+            if name in present or not self._holds(path, is_dir, estimated):
+                continue
+            if is_dir:
+                subtrees.append(build_tree(
+                    path, dict(walk(path, visit, DEFAULT_WORKERS)),
+                    min_size, max_children, visit=visit))
+            else:
+                subtrees.append(FileSystemTree(None, name, [], size))
+
+        folder.delete_node(self)
+        folder.add_subtrees(subtrees)
+        return subtrees
+
+    def _holds(self: CoalescedItems, path: str, is_dir: bool,
+               estimated: bool) -> bool:
+        """Return True iff the entry at <path> of a listing of the folder,
+        which is not one of the folder's other subtrees, is one of the items
+        this leaf stands for.
+
+        <estimated> is whether the folder has an EstimatedItems leaf. That
+        leaf stands for all of the folder's files, so this one then only
+        stands for folders, including folders the rules pruned, which are
+        listed as files.
+        """
+        return is_dir or not estimated or os.path.isdir(path)
+
+    def expand(self: CoalescedItems) -> bool:
+        """Split this leaf into the items it stands for, unless it has
+        already been split.
+
+        Return True iff this leaf was split.
+        """
+        if self._parent_tree is None:
+            return False
+        self.split()
+        return True
+
+
+class EstimatedItems(CoalescedItems):
+    """A leaf that stands for the files of a folder that were too many to
+    stat, with an estimate of their total size as its data_size.
+
+    Calling settle replaces the estimate with the exact size, and split
+    replaces the leaf with the files themselves.
+
+    === Private Attributes ===
+    _error: the error bound of data_size, or None once it is exact.
+    """
+    _error: Optional[int]
+
+    def __init__(self: EstimatedItems, path: str, count: int, estimate: int,
+                 error: int,
+                 options: ScanOptions = (list_directory, 0, None)) -> None:
+        """Initialize a leaf for the <count> files of the folder <path>,
+        whose total size is <estimate>, give or take <error>, which were
+        scanned with <options>.
+        """
+        CoalescedItems.__init__(self, path, count, estimate, options)
+        self._root = '<~{} files>'.format(count)
+        self._error = error
+
+    def expand(self: EstimatedItems) -> bool:
+        """Return False: the files are too many to stat while drawing, so
+        this leaf is only split by calling split.
+        """
+        return False
+
+    def _holds(self: EstimatedItems, path: str, is_dir: bool,
+               estimated: bool) -> bool:
+        """Return True iff the entry at <path> of a listing of the folder
+        is a file, which are the items this leaf stands for.
+        """
+        return not is_dir and not os.path.isdir(path)
+
+    def is_estimate(self: EstimatedItems) -> bool:
+        """Return True iff data_size is still an estimate."""
+        return self._error is not None
+
+    def settle(self: EstimatedItems, size: int) -> None:
+        """Replace the estimated data_size with the exact <size>, and update
+        the data_size of every parent tree to match.
+        """
+        if self._parent_tree is None:
+            return
+        change = size - self.data_size
+        self.data_size = size
+        self.increase_decrease_parent(abs(change), change > 0)
+        self._root = '<{} files>'.format(self._count)
+        self._renamed()
+        self._error = None
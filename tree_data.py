@@ -1,9 +1,21 @@
 from __future__ import annotations
 import os
+import time
+from collections import deque
 from random import randint
 import math
 
-from typing import Tuple, List, Optional, Dict, Any
+from typing import Tuple, List, Optional, Dict, Any, Iterator
+
+# The number of ratios of width to height, per doubling, that the squarified
+# rows of a tree are worked out for.
+ASPECT_STEPS = 32
+
+# The smallest side of a subtree that a HitIndex records the rectangles below
+# instead of the subtree itself, and the side of the square cells it sorts
+# the rectangles into, in pixels.
+HIT_MIN_SIDE = 8
+HIT_CELL = 32
 
 
 class AbstractTree:
@@ -11,14 +23,14 @@ class AbstractTree:
 
     This is an abstract class that should not be instantiated directly.
 
-    You may NOT add any attributes, public or private, to this class.
-    However, part of this assignment will involve you adding and implementing
-    new public *methods* for this interface.
-
     === Public Attributes ===
     data_size: the total size of all leaves of this tree.
     colour: The RGB colour value of the root of this tree.
         Note: only the colours of leaves will influence what the user sees.
+    squarified: whether the treemap of this tree is drawn with the
+        squarified layout, which keeps rectangles close to square, instead
+        of slicing each rectangle in one direction. Only the tree a layout
+        is started from is asked.
 
     === Private Attributes ===
     _root: the root value of this tree, or None if this tree is empty.
@@ -26,6 +38,43 @@ class AbstractTree:
     _parent_tree: the parent tree of this tree; i.e., the tree that contains
         this tree
         as a subtree, or None if this tree is not part of a larger tree.
+    _version: a counter that goes up whenever the data_size or subtrees of
+        this tree, or of any tree below it, change.
+    _structure: a counter that goes up whenever a subtree is added to or
+        removed from this tree, or the root of a subtree changes. Unlike
+        <_version>, it does not change with sizes or with trees further
+        down.
+    _layout_cache: None, or the (version, rect, min_side, chunks, nodes,
+        squarified) that generate_treemap last laid this tree out with.
+        <chunks> holds the rectangle of each leaf subtree, and the chunks of
+        each other subtree, in drawing order, so each tree stores one entry
+        per subtree. <nodes> is nested in the same way and holds the tree
+        each rectangle is drawn for.
+    _hit_index: None, or the HitIndex coordinate_to_tree last looked up
+        a rectangle in.
+    _split_cache: None, or the (version, aspect, order, rows) of the
+        squarified layout of this tree's subtrees last computed, for
+        rectangles whose ratio of width to height rounds to
+        2 ** (aspect / ASPECT_STEPS); see squarify_layout.
+    _removed: the number of subtrees emptied by delete_node that are still
+        in _subtrees. They are only dropped once they are at least half of
+        _subtrees, so that a deletion does not have to find its subtree.
+    _path_cache: None, or the (trees, roots, path) of this tree's path when
+        path() was last asked for the path of one of its subtrees. <trees>
+        are this tree and its parent trees, and <roots> their roots at the
+        time, so the path is reused while they are unchanged.
+    _label_cache: None, or the (data_size, root, prefix, label) that path()
+        last returned <label> for, where <prefix> is the path of the parent
+        tree it was built from.
+    _name_index: None, or the (structure, subtrees) of this tree's non-empty
+        subtrees by the string of their root, built by find.
+    _node_count: the number of non-empty trees in this tree, including
+        itself.
+    _leaves_cache: None, or the (version, leaves) that leaves() last
+        returned a copy of.
+    _expand_cache: None, or the (version, rect, min_side, clip, squarified)
+        of the last call of expand_visible on this tree that expanded
+        nothing.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -46,6 +95,39 @@ class AbstractTree:
     _root: Optional[object]
     _subtrees: List[AbstractTree]
     _parent_tree: Optional[AbstractTree]
+    _version: int
+    _structure: int
+    _layout_cache: Optional[Tuple[int, Tuple[int, int, int, int], int, List,
+                                  List, bool]]
+    _split_cache: Optional[Tuple[int, float, List[int],
+                                 List[Tuple[int, bool]]]]
+    _hit_index: Optional[HitIndex]
+    _removed: int
+    _path_cache: Optional[Tuple[Tuple[AbstractTree, ...], Tuple, str]]
+    _label_cache: Optional[Tuple[int, object, Optional[str], str]]
+    _name_index: Optional[Tuple[int, Dict[str, AbstractTree]]]
+    _node_count: int
+    _leaves_cache: Optional[Tuple[int, List[AbstractTree]]]
+    _expand_cache: Optional[Tuple[int, Tuple[int, int, int, int], int,
+                                  Optional[Tuple[int, int, int, int]], bool]]
+
+    squarified = False
+
+    # The counters and caches start out here, on the class, and are only
+    # stored on a tree once they change. Most of the caches are only ever
+    # used on folders or the root, so leaves do not pay for them.
+    _version = 0
+    _structure = 0
+    _removed = 0
+    _node_count = 1
+    _layout_cache = None
+    _split_cache = None
+    _hit_index = None
+    _path_cache = None
+    _label_cache = None
+    _name_index = None
+    _leaves_cache = None
+    _expand_cache = None
 
     def __init__(self: AbstractTree, root: Optional[object],
                  subtrees: List[AbstractTree], data_size: int = 0) -> None:
@@ -81,9 +163,12 @@ class AbstractTree:
 
         self.colour = (randint(0, 255), randint(0, 255), randint(0, 255))
 
+        if self.is_empty():
+            self._node_count = 0
         for subtree in self._subtrees:
             if subtree is not None:
                 subtree._parent_tree = self
+                self._node_count += subtree._node_count
 
         # 1. Initialize self.colour and self.data_size,
         # according to the docstring.
@@ -96,16 +181,15 @@ class AbstractTree:
     def __len__(self) -> int:
         """Return the number of items contained in this tree.
 
-        """
-        if self.is_empty():
-            return 0
+        The count is kept up to date as the tree changes, so this takes
+        constant time.
 
-        size = 1  # count the root
-        for subtree in self._subtrees:
-            size += subtree.__len__()  # could also do len(subtree) here
-        return size
+        """
+        return self._node_count
 
-    def generate_treemap(self: AbstractTree, rect: Tuple[int, int, int, int]) \
+    def generate_treemap(self: AbstractTree, rect: Tuple[int, int, int, int],
+                         min_side: int = 0,
+                         clip: Optional[Tuple[int, int, int, int]] = None) \
             -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
         """Run the treemap algorithm on this tree and return the rectangles.
 
@@ -114,286 +198,364 @@ class AbstractTree:
 
         One tuple should be returned per non-empty leaf in this tree.
 
+        If <min_side> is positive, rectangles with no area are left out, and
+        a subtree whose rectangle is less than <min_side> pixels wide or high
+        is returned as one rectangle in its own colour instead of being
+        subdivided. The result then only has one tuple per visible leaf or
+        culled subtree, and its length is bounded by the number of pixels.
+
+        If <clip> is given, only the rectangles that overlap it are
+        returned, and subtrees that do not overlap it are not laid out. To
+        draw a zoomed in view, lay the tree out in an enlarged <rect> and
+        clip it to the screen.
+
         @type self: AbstractTree
         @type rect: (int, int, int, int)
             Input is in the pygame format: (x, y, width, height)
+        @type min_side: int
+        @type clip: (int, int, int, int) | None
         @rtype: list[((int, int, int, int), (int, int, int))]
         """
-        # Read the handout carefully to help get started identifying base cases,
-        # and the outline of a recursive step.
-        #
-        # Programming tip: use "tuple unpacking assignment" to easily extract
-        # coordinates of a rectangle, as follows.
-        # x, y, width, height = rect
-
-        if self.is_empty() or self.data_size == 0:
-            return []
-
-        if self._subtrees == [] and self._parent_tree is None:
-            return [(rect, self.colour)]
-
-        if not self._subtrees:
-            if rect[2] > rect[3]:  # just a single file
-
-                return self.base_case_width_greater(rect)
-
-            return self.base_case_height_greater(rect)
-
-        all_rectangles = []
-
-        for i in range(len(self._subtrees)):
-
-            if self._subtrees[i]._subtrees != [] and rect[2] > rect[3]:
-                all_rectangles.extend(self.helper_subtree_width_greater(i, rect)
-                                      )
-
-            elif self._subtrees[i]._subtrees != [] and rect[3] >= rect[2]:
-
-                all_rectangles.extend(self.helper_subtree_height_greater(i, rect
-                                                                         ))
-
-            elif i == len(self._subtrees) - 1 and rect[2] > rect[3]:
-                final_width = self.find_last(True, rect)
-                x = self.get_ith_last(True, rect, i)
-                r = x, rect[1], final_width, rect[3]
-                all_rectangles.extend(self._subtrees[i].generate_treemap(r))
-
-            elif i == len(self._subtrees) - 1 and rect[3] >= rect[2]:
-                final_height = self.find_last(False, rect)
-                a, c = rect[0], rect[2]
-                y = self.get_ith_last(False, rect, i)
-                r = a, y, c, final_height
-                all_rectangles.extend(self._subtrees[i].generate_treemap(r))
+        if clip is not None:
+            return [(r, colour) for r, colour, _
+                    in self.iter_treemap(rect, min_side, clip)]
 
-            elif rect[2] > rect[3]:  # HERE BUG
+        return _flatten_chunks(self._layout_chunks(rect, min_side))
 
-                all_rectangles.extend(self.file_width_greater(i, rect))
+    def _layout_chunks(self: AbstractTree, rect: Tuple[int, int, int, int],
+                       min_side: int) -> List:
+        """ Return the rectangles of generate_treemap(rect, min_side) as
 
-            elif rect[3] >= rect[2]:
-
-                all_rectangles.extend(self.file_height_greater(i, rect))
-
-        return all_rectangles
-
-    def file_height_greater(self, i: int, rect: Tuple[int, int, int,
-                                                      int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Helper for generate tree map when the height is greater than width
-
-        and self has no subtrees, returns a tuple with a rectangle(s) and
-        colour(s)
+        nested chunks, reusing and updating cached chunks as _walk_layout
+        does.
         """
-        if i == 0:
-            return self._subtrees[i].generate_treemap(rect)
-
-        y = self.get_ith_last(False, rect, i)
-        return self._subtrees[i].generate_treemap((rect[0], y, rect[2],
-                                                   rect[3]))
-
-    def file_width_greater(self, i: int, rect: Tuple[int, int, int,
-                                                     int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Helper for generate tree map when the width is greater that height
-
-        and self has no subtrees, returns a tuple with a rectangle(s) and
-        colour(s)
+        chunks = []
+        for _ in self._walk_layout(rect, min_side, chunks, False):
+            pass
+        return chunks
+
+    def _walk_layout(self: AbstractTree, rect: Tuple[int, int, int, int],
+                     min_side: int, chunks: List, stream: bool) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int],
+                              AbstractTree]]:
+        """ Lay this tree out in <rect>, appending the rectangles of
+
+        generate_treemap(rect, min_side) to <chunks> as nested chunks, and
+        yield them as iter_treemap does if <stream> is True.
+
+        The cached chunks of every subtree whose version and rectangle are
+        unchanged since it was last laid out are reused, and the chunks of
+        every subtree that is laid out again to the end are cached.
         """
-        if i == 0:
-            return self._subtrees[i].generate_treemap(rect)
-
-        x = self.get_ith_last(True, rect, i)
-        r = x, rect[1], rect[2], rect[3]
-        return self._subtrees[i].generate_treemap(r)
-
-    def helper_subtree_width_greater(self, i: int, rect: Tuple[int, int, int,
-                                                               int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Helper for generate tree map when the width is greater that height
-
-        and self has subtrees, returns a tuple with a rectangle(s) and colour(s)
-        """
-        if i == len(self._subtrees) - 1:
-            final_width = self.find_last(True, rect)
-            x = self.get_ith_last(True, rect, i)
-            return self._subtrees[i].generate_treemap(
-                (x, rect[1], final_width, rect[3]))
-
-        if not self.sum_rest_subs(i + 1):
-            proportion = self._subtrees[i].data_size / self. \
-                data_size
-            x = self.get_ith_last(True, rect, i)
-            b, c, d = rect[1], rect[2], rect[3]
-            width = math.floor(proportion * c)
-            new = (x, b, width, d)
-            return self._subtrees[i].generate_treemap(new)
-
-        proportion = self._subtrees[i].data_size / self. \
-            data_size
-        x = self.get_ith_last(True, rect, i)
-        b, c, d = rect[1], rect[2], rect[3]
-        width = math.floor(proportion * c)
-        diff = rect[2] - (width + x)
-        new = (x, b, width + diff, d)
-        return self._subtrees[i].generate_treemap(new)
-
-    def helper_subtree_height_greater(self, i: int,
-                                      rect: Tuple[int, int, int, int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Helper for generate tree map when the height is greater than width
-
-        and self has subtrees, returns a tuple with a rectangle and colour
-        """
-
-        if i == len(self._subtrees) - 1:
-            final_height = self.find_last(False, rect)
-            a, y, c, d = rect[0], rect[1], rect[2], rect[3]
-            y = self.get_ith_last(False, rect, i)
-            return self._subtrees[i].generate_treemap((a, y, c, final_height))
-
-        if not self.sum_rest_subs(i + 1):
-            proportion = self._subtrees[i].data_size / self. \
-                data_size
-            y = self.get_ith_last(False, rect, i)
-            a, c, d = rect[0], rect[2], rect[3]
-            height = math.floor(proportion * d)
-            new = (a, y, c, height)
-            return self._subtrees[i].generate_treemap(new)
-
-        proportion = self._subtrees[i].data_size / self. \
-            data_size
-        y = self.get_ith_last(False, rect, i)
-        a, c, d = rect[0], rect[2], rect[3]
-        height = math.floor(proportion * d)
-        diff = rect[3] - (height + y)
-        new = (a, y, c, height + diff)
-        return self._subtrees[i].generate_treemap(new)
-
-    def base_case_width_greater(self, rect: Tuple[int, int, int, int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Return a tree map rectangle with colour when there is no more
-
-        subtrees and width is greater than height.
+        squarified = self.squarified
+
+        # Each entry of <stack> is a tree being laid out, its rectangle, an
+        # iterator over the (subtree, rectangle) pairs that are still to be
+        # laid out, and the chunks and nodes so far. Descending into a
+        # subtree suspends its parent's iterator until the subtree is done.
+        stack = [(None, rect, iter([(self, rect)]), chunks, [])]
+        while stack:
+            _, _, pairs, found, drawn = stack[-1]
+            for tree, r in pairs:
+                if tree._root is None or tree.data_size == 0:
+                    continue
+                culled = min_side > 0 and min(r[2], r[3]) < min_side
+                if culled and (r[2] <= 0 or r[3] <= 0):
+                    continue
+                if not tree._subtrees or culled:
+                    found.append((r, tree.colour))
+                    drawn.append(tree)
+                    if stream:
+                        yield r, tree.colour, tree
+                    continue
+
+                cached = tree._cached_layout(r, min_side, squarified)
+                if cached is not None:
+                    found.append(cached[0])
+                    drawn.append(cached[1])
+                    if stream:
+                        yield from _iter_chunks(*cached)
+                else:
+                    stack.append((tree, r, zip(
+                        tree._subtrees, tree._child_rects(r, squarified)),
+                        [], []))
+                    break
+            else:
+                tree, r, _, found, drawn = stack.pop()
+                if tree is not None:
+                    tree._layout_cache = (tree._version, r, min_side, found,
+                                          drawn, squarified)
+                    stack[-1][3].append(found)
+                    stack[-1][4].append(drawn)
+
+    def _cached_layout(self: AbstractTree, rect: Tuple[int, int, int, int],
+                       min_side: int, squarified: bool) \
+            -> Optional[Tuple[List, List]]:
+        """ Return the cached chunks and nodes of this tree laid out in
+
+        <rect> with <min_side> and the layout mode <squarified>, or None if
+        it has changed or was last laid out differently.
         """
-        if self == self._parent_tree._subtrees[-1]:
-            return [(rect, self.colour)]
-
-        index = self.find_position() + 1
-        if not self._parent_tree.sum_rest_subs(index):
-            proportion = self.data_size / self._parent_tree.data_size
-            width = math.floor(proportion * rect[2])
-            return [((rect[0], rect[1], width, rect[3]), self.colour)]
-
-        width = rect[2] - rect[0]
-        return [((rect[0], rect[1], width, rect[3]), self.colour
-                 )]
+        cache = self._layout_cache
+        if cache is not None and cache[0] == self._version \
+                and cache[1] == rect and cache[2] == min_side \
+                and cache[5] == squarified:
+            return cache[3], cache[4]
+        return None
 
-    def base_case_height_greater(self, rect: Tuple[int, int, int, int]) \
-            -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
-        """ Return a tree map rectangle with colour when there is no more
+    def iter_treemap(self: AbstractTree, rect: Tuple[int, int, int, int],
+                     min_side: int = 0,
+                     clip: Optional[Tuple[int, int, int, int]] = None,
+                     cache: bool = True) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int],
+                              AbstractTree]]:
+        """ Yield the rectangles of generate_treemap(rect, min_side, clip) in
+
+        the same order, each with its colour and the leaf, or culled subtree,
+        it is drawn for: ((x, y, width, height), (r, g, b), tree).
+
+        Each rectangle is yielded as soon as it is laid out, so a caller can
+        draw or search them as they come and stop early. Cached layouts are
+        reused and updated as in generate_treemap, which holds the chunks of
+        every subtree laid out so far, so memory still grows with the number
+        of rectangles. If <cache> is False, or <clip> is given, the cache is
+        neither used nor filled and only the path to the current subtree is
+        held. The tree must not change until the generator is finished.
 
-        subtrees and height is greater than width.
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type min_side: int
+        @type clip: (int, int, int, int) | None
+        @type cache: bool
+        @rtype: iterator[((int, int, int, int), (int, int, int), AbstractTree)]
         """
-
-        if len(self._subtrees) == 1:
-            return [(rect, self.colour)]
-
-        if self == self._parent_tree._subtrees[-1]:
-            return [(rect, self.colour)]
-
-        index = self.find_position() + 1
-
-        if not self._parent_tree.sum_rest_subs(index):
-            proportion = self.data_size / self._parent_tree.data_size
-            height = math.floor(proportion * rect[3])
-            return [((rect[0], rect[1], rect[2], height), self.colour)]
-
-        height = rect[3] - rect[1]
-        return [((rect[0], rect[1], rect[2], height), self.
-                 colour)]
-
-    def find_position(self) -> int:
-        """ Return the position of self in self._parent_tree.subtrees.
-
-        Precondition: self._parent_tree is not None.
-
+        if clip is not None or not cache:
+            return self._iter_clipped(rect, min_side, clip, self.squarified)
+        return self._walk_layout(rect, min_side, [], True)
+
+    def _iter_clipped(self: AbstractTree, rect: Tuple[int, int, int, int],
+                      min_side: int,
+                      clip: Optional[Tuple[int, int, int, int]],
+                      squarified: bool) \
+            -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int],
+                              AbstractTree]]:
+        """ Yield the rectangles of iter_treemap(rect, min_side, clip) with
+
+        the layout mode <squarified>, laying out only the subtrees whose
+        rectangles overlap <clip> if it is given, and without using the
+        layout cache.
         """
-        index = 0
-
-        for subtree in self._parent_tree._subtrees:
-            if subtree == self:
-                return index
-            index += 1
-
-        return index
-
-    def get_ith_last(self: AbstractTree, result: bool,
-                     rect: Tuple[int, int, int, int], index: int) -> int:
-        """ pass.
+        # Every rectangle lies within its parent's, so a subtree that does not
+        # overlap <clip> has no rectangles that do.
+        stack = [iter([(self, rect)])]
+        while stack:
+            for tree, r in stack[-1]:
+                if tree._root is None or tree.data_size == 0 \
+                        or clip is not None and not rects_overlap(r, clip):
+                    continue
+                culled = min_side > 0 and min(r[2], r[3]) < min_side
+                if culled and (r[2] <= 0 or r[3] <= 0):
+                    continue
+                if not tree._subtrees or culled:
+                    yield r, tree.colour, tree
+                    continue
+                stack.append(zip(tree._subtrees,
+                                 tree._child_rects(r, squarified)))
+                break
+            else:
+                stack.pop()
+
+    def generate_treemap_lod(self: AbstractTree,
+                             rect: Tuple[int, int, int, int],
+                             min_side: int = 0,
+                             clip: Optional[Tuple[int, int, int, int]] = None,
+                             max_depth: Optional[int] = None,
+                             max_rects: Optional[int] = None,
+                             seconds: Optional[float] = None,
+                             token: Optional[LayoutToken] = None) \
+            -> Tuple[List[Tuple[Tuple[int, int, int, int],
+                                Tuple[int, int, int]]],
+                     Optional[LayoutToken]]:
+        """ Return the rectangles of generate_treemap(rect, min_side, clip),
+
+        as far as they can be laid out within a budget, and a token to
+        refine them further with, or None if they are complete.
+
+        The tree is laid out one level at a time, and a subtree that has not
+        been subdivided yet is drawn as one rectangle in its own colour.
+        Subdividing stops before a subtree deeper than <max_depth> would be
+        subdivided, before there would be more than <max_rects> rectangles,
+        or once <seconds> have passed, whichever is first. At least one
+        subtree is subdivided within <seconds>, however short it is.
+
+        Passing the returned <token> back in with the same <rect>, <min_side>
+        and <clip> carries on from where the last call stopped, with new
+        budgets. If the tree has changed since, the layout starts over.
 
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type min_side: int
+        @type clip: (int, int, int, int) | None
+        @type max_depth: int | None
+        @type max_rects: int | None
+        @type seconds: float | None
+        @type token: LayoutToken | None
+        @rtype: (list[((int, int, int, int), (int, int, int))],
+            LayoutToken | None)
         """
-        if result:
-            data = rect[0]
-            for i in range(len(self._subtrees)):
-
-                if i == index:
-                    return data
-
-                proportion = self._subtrees[i].data_size / self.data_size
-                amount = math.floor(proportion * rect[2])
-                data += amount
-            return data
-
-        data = rect[1]
-        for i in range(len(self._subtrees)):
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        if token is None or not token._matches(self, rect, min_side, clip):
+            token = LayoutToken(self, rect, min_side, clip)
+        frontier = token._frontier
+
+        if max_rects is not None and token._count is None:
+            token._count = len(_flatten_chunks(token._chunks))
+
+        while frontier:
+            tree, r, depth, found, drawn, index = frontier[0]
+            if max_depth is not None and depth >= max_depth:
+                break
+
+            cached = None
+            if clip is None and max_depth is None and max_rects is None:
+                cached = tree._cached_layout(r, min_side, token._squarified)
+            if cached is not None:
+                frontier.popleft()
+                found[index], drawn[index] = cached
+                token._count = None
+                continue
+
+            items, nodes, inner = [], [], []
+            for subtree, sub_rect in zip(
+                    tree._subtrees, tree._child_rects(r, token._squarified)):
+                drawn_as = token._classify(subtree, sub_rect)
+                if drawn_as is not None:
+                    if drawn_as:
+                        inner.append((subtree, sub_rect, depth + 1, items,
+                                      nodes, len(items)))
+                    items.append((sub_rect, subtree.colour))
+                    nodes.append(subtree)
+            if max_rects is not None \
+                    and token._count + len(items) - 1 > max_rects:
+                break
+
+            frontier.popleft()
+            found[index], drawn[index] = items, nodes
+            frontier.extend(inner)
+            if token._count is not None:
+                token._count += len(items) - 1
+            if clip is None:
+                token._expanded.append((tree, r, items, nodes))
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+        rectangles = _flatten_chunks(token._chunks)
+        if frontier:
+            return rectangles, token
+
+        # The layout is complete, so cache it for generate_treemap.
+        for tree, r, items, nodes in token._expanded:
+            tree._layout_cache = (tree._version, r, min_side, items, nodes,
+                                  token._squarified)
+        return rectangles, None
+
+    def _changed(self: AbstractTree) -> None:
+        """ Record that the layout of this tree, and so of every parent tree,
+
+        may have changed.
+        """
+        tree = self
+        while tree is not None:
+            tree._version += 1
+            tree = tree._parent_tree
 
-            if i == index:
-                return data
+    def _renamed(self: AbstractTree) -> None:
+        """ Record that the root of this tree has changed, so that the
 
-            proportion = self._subtrees[i].data_size / self.data_size
-            amount = math.floor(proportion * rect[3])
-            data += amount
-        return data
+        parent tree's index of its subtrees by name is rebuilt.
+        """
+        if self._parent_tree is not None:
+            self._parent_tree._structure += 1
+        self._changed()
 
-    def sum_rest_subs(self, index: int) -> bool:
-        """ Return True if the sum of subtrees from <index> is zero
+    def _child_rects(self: AbstractTree, rect: Tuple[int, int, int, int],
+                     squarified: bool = False) \
+            -> List[Tuple[int, int, int, int]]:
+        """ Return the rectangle of each subtree when self is drawn in <rect>,
 
-        False otherwise
+        in the order of self._subtrees, with the squarified layout if
+        <squarified> is True.
         """
-        total = 0
+        sizes = [subtree.data_size for subtree in self._subtrees]
+        if not squarified or rect[2] <= 0 or rect[3] <= 0:
+            return slice_layout(rect, sizes, self.data_size)
+
+        # The rows are found for the nearest of a few fixed ratios of width
+        # to height, so that they can be reused when the rectangle is zoomed
+        # or only changes a little.
+        aspect = round(math.log2(rect[2] / rect[3]) * ASPECT_STEPS)
+        split = self._split_cache
+        if split is None or split[0] != self._version or split[1] != aspect:
+            order = sorted(range(len(sizes)), key=sizes.__getitem__,
+                           reverse=True)
+            split = (self._version, aspect, order, squarify_rows(
+                2 ** (aspect / ASPECT_STEPS), 1, [sizes[i] for i in order]))
+            self._split_cache = split
+        return squarify_layout(rect, sizes, self.data_size, split[2],
+                               split[3])
+
+    def expand(self: AbstractTree) -> bool:
+        """ Build the subtrees of this tree if they have not been built yet.
+
+        Return True iff this tree changed. Trees that are always built in
+        full, like this one, have nothing to expand.
+        """
+        return False
 
-        for subtree in self._subtrees[index:]:
-            total += subtree.data_size
+    def expand_visible(self: AbstractTree, rect: Tuple[int, int, int, int],
+                       min_side: int = 4,
+                       clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> bool:
+        """ Expand every leaf whose treemap rectangle in <rect> is at least
 
-        return total == 0
+        <min_side> pixels wide and high, and overlaps <clip> if it is given,
+        along with any of their new subtrees that still are.
 
-    def find_last(self, result: bool, rect: Tuple) -> int:
-        """ pass
+        Subtrees smaller than <min_side> or outside <clip> are not entered,
+        since no leaf below them can qualify, so the walk only visits the
+        trees that are drawn subdivided. A call that expands nothing is
+        remembered, and repeating it before this tree changes returns at
+        once.
 
+        Return True iff any tree was expanded.
         """
-        if result:
-            data_size = 0
-
-            for i in range(len(self._subtrees)):
-
-                if i == len(self._subtrees) - 1:
-                    return rect[2] - data_size
+        if self.is_empty() or self.data_size == 0:
+            return False
+        key = (self._version, rect, min_side, clip, self.squarified)
+        if self._expand_cache == key:
+            return False
 
-                proportion = self._subtrees[i].data_size / self.data_size
+        expanded = False
+        stack = [(self, rect)]
 
-                amount = math.floor(proportion * rect[2])
-                data_size += amount
-            return rect[2] - data_size
+        while stack:
+            tree, r = stack.pop()
+            if min(r[2], r[3]) < min_side \
+                    or clip is not None and not rects_overlap(r, clip):
+                continue
 
-        data_size = 0
-        for i in range(len(self._subtrees)):
+            if not tree._subtrees:
+                if not tree.expand():
+                    continue
+                expanded = True
 
-            if i == len(self._subtrees) - 1:
-                return rect[3] - data_size
+            if tree.data_size > 0:
+                stack.extend(zip(tree._subtrees,
+                                 tree._child_rects(r, self.squarified)))
 
-            proportion = self._subtrees[i].data_size / self.data_size
-            amount = math.floor(proportion * rect[3])
-            data_size += amount
-        return rect[3] - data_size
+        if not expanded:
+            self._expand_cache = key
+        return expanded
 
     def get_separator(self: AbstractTree) -> str:
         """Return the string used to separate nodes in the string
@@ -410,18 +572,32 @@ class AbstractTree:
     def leaves(self) -> List[AbstractTree]:
         """ Return all leaves in self and store it in a list.
 
-        """
-        if self.is_empty():
-            return []
+        The leaves are cached until this tree changes, and a new list of
+        them is returned each time.
 
-        if not self._subtrees and self.data_size > 0:
-            return [self]
+        """
+        cache = self._leaves_cache
+        if cache is not None and cache[0] == self._version:
+            return list(cache[1])
 
         leaves = []
-        for subtree in self._subtrees:
-            leaves.extend(subtree.leaves())
+        append = leaves.append
+
+        # As in generate_treemap, each entry of <stack> iterates over the
+        # subtrees of one tree that are still to be visited.
+        stack = [iter([self])]
+        while stack:
+            for tree in stack[-1]:
+                if tree._subtrees:
+                    stack.append(iter(tree._subtrees))
+                    break
+                if tree._root is not None and tree.data_size > 0:
+                    append(tree)
+            else:
+                stack.pop()
 
-        return leaves
+        self._leaves_cache = (self._version, leaves)
+        return list(leaves)
 
     def delete_item(self, item: Any) -> bool:
         """Delete *one* occurrence of the given item from this tree.
@@ -430,7 +606,9 @@ class AbstractTree:
         Do not modify this tree if it does not contain <item>.
 
         """
-        # Following is a modified delete_item implementation done in CSC148.
+        # Following is a modified delete_item implementation done in CSC148,
+        # with the recursion replaced by a stack of (tree, iterator over its
+        # subtrees) pairs.
 
         if self.is_empty():
             # The item is not in the tree.
@@ -440,11 +618,32 @@ class AbstractTree:
             self._delete_root()
             return True
 
-        for subtree in self._subtrees:
-            deleted = subtree.delete_item(item)
-            if deleted and subtree.is_empty():
-                self._subtrees.remove(subtree)
-                return True
+        stack = [(self, iter(self._subtrees))]
+        while stack:
+            tree, subtrees = stack[-1]
+            for subtree in subtrees:
+                if subtree._root is None:
+                    continue
+                if subtree._root == item:
+                    subtree._delete_root()
+                    if subtree.is_empty():
+                        tree._subtrees.remove(subtree)
+                        if len(tree._subtrees) == tree._removed:
+                            # Only subtrees emptied by delete_node are left,
+                            # so <tree> is now a leaf.
+                            tree._subtrees = []
+                            tree._removed = 0
+                        if tree is self:
+                            return True
+                        # As in the recursive version, the parent of <tree>
+                        # keeps searching its remaining subtrees.
+                        stack.pop()
+                        break
+                elif subtree._subtrees:
+                    stack.append((subtree, iter(subtree._subtrees)))
+                    break
+            else:
+                stack.pop()
         return False
 
     def _delete_root(self) -> None:
@@ -454,7 +653,116 @@ class AbstractTree:
         """
         if not self._subtrees:
             # This is a leaf. Deleting the root gives an empty tree.
+            self._count_changed(-1)
             self._root = None
+            self._renamed()
+
+    def delete_node(self: AbstractTree, node: AbstractTree) -> None:
+        """Delete <node>, a leaf or folder of this tree, and reduce the
+        data_size of its parent trees by its data_size.
+
+        Each parent tree below this one that is left with no subtrees is
+        deleted as well. Only the parent trees of <node> are visited, so
+        this takes time proportional to the depth of <node>, however many
+        subtrees its parents have.
+
+        Precondition: <node> is a non-empty subtree of this tree.
+        """
+        size = node.data_size
+        nodes = node._node_count
+        tree = node._parent_tree
+        node._clear()
+
+        # Whether the tree below <tree> was emptied, and whether <tree> may
+        # be deleted if it is left with no subtrees.
+        emptied = True
+        collapse = node is not self
+        while tree is not None:
+            tree.data_size -= size
+            tree._node_count -= nodes
+            tree._version += 1
+            if emptied:
+                tree._structure += 1
+                tree._removed += 1
+                if tree._removed * 2 >= len(tree._subtrees):
+                    tree._subtrees = [subtree for subtree in tree._subtrees
+                                      if subtree._root is not None]
+                    tree._removed = 0
+            if tree is self:
+                collapse = False
+            emptied = collapse and not tree._subtrees
+            parent = tree._parent_tree
+            if emptied:
+                tree._clear()
+                nodes += 1
+            tree = parent
+
+    def _clear(self: AbstractTree) -> None:
+        """Make this tree empty and detach it from its parent tree, leaving
+        it in the parent's _subtrees for delete_node to drop.
+        """
+        self._root = None
+        self._subtrees = []
+        self._parent_tree = None
+        self.data_size = 0
+        self._removed = 0
+        self._node_count = 0
+        self._version += 1
+        self._structure += 1
+
+    def _count_changed(self: AbstractTree, nodes: int) -> None:
+        """Add <nodes> to the node count of this tree and every parent
+        tree.
+        """
+        tree = self
+        while tree is not None:
+            tree._node_count += nodes
+            tree = tree._parent_tree
+
+    def add_subtrees(self: AbstractTree, subtrees: List[AbstractTree]) \
+            -> None:
+        """ Append <subtrees> to the subtrees of this tree.
+
+        The data_size of this tree and every parent tree grows by the total
+        data_size of <subtrees>.
+
+        Precondition: this tree is non-empty.
+        """
+        added = 0
+        nodes = 0
+        for subtree in subtrees:
+            subtree._parent_tree = self
+            added += subtree.data_size
+            nodes += subtree._node_count
+
+        self._subtrees.extend(subtrees)
+        self.data_size += added
+        self._version += 1
+        self._structure += 1
+        self.increase_decrease_parent(added, True)
+        self._count_changed(nodes)
+
+    def replace_subtrees(self: AbstractTree,
+                         subtrees: List[AbstractTree]) -> None:
+        """ Replace all the subtrees of this tree with <subtrees>.
+
+        The old subtrees are detached, the bookkeeping of deleted subtrees
+        is reset, and the data_size and node count of this tree and every
+        parent tree change to match <subtrees>. If <subtrees> is empty,
+        this tree is left as a leaf of size 0.
+
+        Precondition: this tree is non-empty.
+        """
+        for subtree in self._subtrees:
+            subtree._parent_tree = None
+        self.increase_decrease_parent(self.data_size, False)
+        self._count_changed(1 - self._node_count)
+        self._subtrees = []
+        self._removed = 0
+        self.data_size = 0
+        self._version += 1
+        self._structure += 1
+        self.add_subtrees(subtrees)
 
     def reduce_size(self: FileSystemTree, data: int) -> None:
         """ Reduces the size of every parent tree of root by the data size of
@@ -462,53 +770,43 @@ class AbstractTree:
 
         Precondition: <data> is a size of at least one leaf in self
         """
-        if self.is_empty():
-            return None
-
-        if self._parent_tree is None:
-            return None
+        tree = self
 
-        self._parent_tree.data_size -= data
-        self._parent_tree.reduce_size(data)
-        return None
+        while not tree.is_empty() and tree._parent_tree is not None:
+            tree._parent_tree.data_size -= data
+            tree._parent_tree._version += 1
+            tree = tree._parent_tree
 
     def mouse_right(self, coordinate: Tuple[int, int],
                     rect: Tuple[int, int, int, int],
+                    clip: Optional[Tuple[int, int, int, int]] = None
                     ) -> None:
         """ Mutate the tree so the selected rectangle is removed and the tree
 
         size is updated for every parent tree and subtree.
 
+        <rect> and <clip> are as for coordinate_to_tree.
         """
 
-        if self.is_empty():
-            return None
-
-        dictionary = coordinate_leaf(self.leaves(), self.generate_treemap(rect))
-
-        for item in dictionary:
-            if coordinates_in_range(item, coordinate):
-                for obj in dictionary[item]:
-                    obj.reduce_size(obj.data_size)
-                    obj.data_size = 0
-                    self.delete_item(obj._root)
-                return None
-
-        return None
+        leaf = self.coordinate_to_tree(coordinate, rect, clip)
+        if leaf is not None:
+            self.delete_node(leaf)
 
     def coordinate_to_tree(self, coordinates: Tuple[int, int],
-                           rect: Tuple[int, int, int, int]) -> \
-            Optional[AbstractTree]:
+                           rect: Tuple[int, int, int, int],
+                           clip: Optional[Tuple[int, int, int, int]] = None) \
+            -> Optional[AbstractTree]:
         """ Return the corresponding tree of a visual with <coordinates>.
 
+        The rectangles are looked up in a HitIndex of the part of <rect>
+        inside <clip>, or all of it if <clip> is None, which is kept until
+        this tree, <rect>, <clip> or the layout mode changes. When zoomed in,
+        pass the screen as <clip> so that only the part on screen is indexed.
         """
-        dictionary = coordinate_leaf(self.leaves(), self.generate_treemap(rect))
-
-        for item in dictionary:
-            if coordinates_in_range(item, coordinates):
-                return dictionary[item][0]
-
-        return None
+        index = self._hit_index
+        if index is None or not index._matches(self, rect, clip):
+            index = self._hit_index = HitIndex(self, rect, clip)
+        return index.find(coordinates)
 
     def increase_decrease(self: AbstractTree, increase: bool) -> int:
         """ returns the amount <self data size> was changed by
@@ -519,11 +817,13 @@ class AbstractTree:
         if increase:
             added = math.ceil(self.data_size * 0.01)
             self.data_size += added
+            self._version += 1
             return added
 
         subtracted = math.ceil(self.data_size * 0.01)
         if (self.data_size - subtracted) >= 1:
             self.data_size -= subtracted
+            self._version += 1
             return subtracted
 
         return 0
@@ -538,21 +838,75 @@ class AbstractTree:
         Precondition: self is a leaf
 
         """
-        if increase:
-
-            if self._parent_tree is None:
-                return None
-
-            self._parent_tree.data_size += size
-            self._parent_tree.increase_decrease_parent(size, True)
-            return None
-
-        if self._parent_tree is None:
-            return None
-
-        self._parent_tree.data_size -= size
-        self._parent_tree.increase_decrease_parent(size, False)
-        return None
+        if not increase:
+            size = -size
+
+        tree = self._parent_tree
+        while tree is not None:
+            tree.data_size += size
+            tree._version += 1
+            tree = tree._parent_tree
+
+    def apply_size_deltas(self: AbstractTree,
+                          deltas: Dict[AbstractTree, int]) -> None:
+        """Add each change in <deltas> to the data_size of its tree and of
+        every parent tree.
+
+        The changes below each tree are added up first, so the data_size
+        and version of each tree are written at most once, however many
+        trees in <deltas> are below it. The version of every parent tree of
+        a changed tree is bumped, even if its data_size is unchanged.
+
+        Raise ValueError, and change nothing, if any data_size would become
+        negative.
+
+        Precondition: every tree in <deltas> is a non-empty subtree of this
+        tree.
+        """
+        # The number of subtrees of each parent tree whose total change is
+        # not yet known. Each tree is counted in its parent once: by the
+        # walk up from it if it is in <deltas>, and otherwise by the first
+        # walk to reach it.
+        pending = {}
+        for tree in deltas:
+            parent = tree._parent_tree
+            while parent is not None:
+                if parent in pending:
+                    pending[parent] += 1
+                    break
+                pending[parent] = 1
+                if parent in deltas:
+                    break
+                parent = parent._parent_tree
+
+        # Visit each tree once its subtrees have been, carrying their
+        # total change up to its parent. Every parent of a changed tree is
+        # changed too, even if the changes below it cancel out, since its
+        # subtrees are laid out differently.
+        totals = dict(deltas)
+        touched = {tree for tree, change in deltas.items() if change}
+        ready = [tree for tree in deltas if tree not in pending]
+        changed = []
+        while ready:
+            tree = ready.pop()
+            change = totals.get(tree, 0)
+            parent = tree._parent_tree
+            if tree in touched:
+                if tree.data_size + change < 0:
+                    raise ValueError('data_size of {} would be negative'
+                                     .format(tree._root))
+                changed.append((tree, tree.data_size + change))
+                if parent is not None:
+                    touched.add(parent)
+            if parent is not None:
+                totals[parent] = totals.get(parent, 0) + change
+                pending[parent] -= 1
+                if not pending[parent]:
+                    ready.append(parent)
+
+        for tree, size in changed:
+            tree.data_size = size
+            tree._version += 1
 
     def node_appender(self: FileSystemTree) -> List:
         """ Traverses self while concatenating nodes with the appropriate
@@ -560,15 +914,12 @@ class AbstractTree:
         separator between each node using file separators.
 
         """
-        if self.is_empty():
-            return []
-
-        if self._parent_tree is None:
-            return [self._root]
-
-        keeper = [self._root]
+        keeper = []
+        tree = self
 
-        keeper.extend(self._parent_tree.node_appender())
+        while tree is not None and not tree.is_empty():
+            keeper.append(tree._root)
+            tree = tree._parent_tree
 
         return keeper
 
@@ -578,10 +929,80 @@ class AbstractTree:
 
         from root to node with the <data size> of self.
 
+        The path of the parent tree is cached there and shared by all of its
+        subtrees, and the result is cached here, so asking again while the
+        tree is unchanged only checks the parent trees and builds no string.
+
+        """
+        parent = self._parent_tree
+        prefix = None if parent is None else parent._folder_path()
+        label = self._label_cache
+        if label is None or label[0] != self.data_size \
+                or label[1] is not self._root or label[2] is not prefix:
+            name = str(self._root)
+            if prefix is not None:
+                name = prefix + self.get_separator() + name
+            label = self._label_cache = (self.data_size, self._root, prefix,
+                                         name + ' ({})'.format(self.data_size))
+        return label[3]
+
+    def _folder_path(self: AbstractTree) -> str:
+        """Return the path from the root to this tree, without a size.
+
+        The path is cached until this tree or one of its parent trees is
+        moved or renamed.
+        """
+        cache = self._path_cache
+        if cache is not None:
+            tree = self
+            for node, root in zip(cache[0], cache[1]):
+                if tree is not node or tree._root is not root:
+                    break
+                tree = tree._parent_tree
+            else:
+                if tree is None:
+                    return cache[2]
+
+        trees = []
+        tree = self
+        while tree is not None:
+            trees.append(tree)
+            tree = tree._parent_tree
+        roots = tuple(tree._root for tree in trees)
+        path = self.get_separator().join(str(root)
+                                         for root in reversed(roots))
+        self._path_cache = (tuple(trees), roots, path)
+        return path
+
+    def find(self: AbstractTree, path: str) -> Optional[AbstractTree]:
+        """Return the subtree of this tree at <path>, or None if there is
+        none.
+
+        <path> is in the form path() returns, without the size, starting
+        with the root of this tree. Each tree on the way keeps an index of
+        its subtrees by name, which is rebuilt only after subtrees are added,
+        removed or renamed, so a lookup takes one dictionary lookup per
+        level of <path>, however often sizes change.
         """
+        if self.is_empty():
+            return None
+        names = path.split(self.get_separator())
+        if names[0] != str(self._root):
+            return None
 
-        return path_to_node(self, self.node_appender()) + ' ({})' \
-            .format(self.data_size)
+        tree = self
+        for name in names[1:]:
+            index = tree._name_index
+            if index is None or index[0] != tree._structure:
+                # The first of several subtrees with the same name is found.
+                index = tree._name_index = (tree._structure, {
+                    str(subtree._root): subtree
+                    for subtree in reversed(tree._subtrees)
+                    if subtree._root is not None})
+            tree = index[1].get(name)
+            if tree is None:
+                return None
+        return tree
 
 
 class FileSystemTree(AbstractTree):
@@ -597,10 +1018,17 @@ class FileSystemTree(AbstractTree):
     as reported by os.path.getsize.
     """
 
-    def __init__(self: FileSystemTree, path: str) -> None:
+    def __init__(self: FileSystemTree, path: Optional[str],
+                 root: Optional[object] = None,
+                 subtrees: Optional[List[FileSystemTree]] = None,
+                 data_size: int = 0) -> None:
         """Store the file tree structure contained in the given file or folder.
 
-        Precondition: <path> is a valid path for this computer.
+        If <path> is None, pass the other arguments directly to the superclass
+        constructor without touching the disk. This is used by the scanners
+        in scanner.py, which list directories themselves.
+
+        Precondition: <path> is None or a valid path for this computer.
         """
         # Remember that you should recursively go through the file system
         # and create new FileSystemTree objects for each file and folder
@@ -608,9 +1036,14 @@ class FileSystemTree(AbstractTree):
         #
         # Also remember to make good use of the superclass constructor!
 
+        if path is None:
+            if subtrees is None:
+                subtrees = []
+            AbstractTree.__init__(self, root, subtrees, data_size)
+
         # base case when path is a leaf (just a file)
 
-        if not os.path.isdir(path):
+        elif not os.path.isdir(path):
             AbstractTree.__init__(self, os.path.basename(path),
                                   [], os.path.getsize(path))
 
@@ -633,6 +1066,403 @@ class FileSystemTree(AbstractTree):
         return os.path.sep
 
 
+class LayoutToken:
+    """The state of a layout by AbstractTree.generate_treemap_lod that has
+    not been refined to the end yet.
+
+    === Private Attributes ===
+    _tree: the tree being laid out.
+    _version: the version of <_tree> when the layout started.
+    _rect: the rectangle <_tree> is laid out in.
+    _min_side: the smallest side of a subtree that is subdivided.
+    _clip: the rectangle the layout is clipped to, or None.
+    _squarified: the layout mode of <_tree> when the layout started.
+    _chunks: the rectangles so far, in the nested chunks of
+        AbstractTree._layout_chunks.
+    _nodes: the tree each rectangle of <_chunks> is drawn for, nested in
+        the same way.
+    _frontier: the (tree, rect, depth, chunk, nodes, index) of each subtree
+        that is still drawn as one rectangle but should be subdivided, in
+        the order they are to be subdivided in. The rectangle is
+        chunk[index], and the tree is nodes[index].
+    _expanded: the (tree, rect, chunk, nodes) of each subtree that has
+        been subdivided, to be cached once the layout is complete.
+    _count: the number of rectangles in <_chunks>, or None if it has not
+        been counted since cached chunks were added to it.
+    """
+    _tree: AbstractTree
+    _version: int
+    _rect: Tuple[int, int, int, int]
+    _min_side: int
+    _clip: Optional[Tuple[int, int, int, int]]
+    _squarified: bool
+    _chunks: List
+    _nodes: List
+    _frontier: deque
+    _expanded: List[Tuple[AbstractTree, Tuple[int, int, int, int], List,
+                          List]]
+    _count: Optional[int]
+
+    def __init__(self: LayoutToken, tree: AbstractTree,
+                 rect: Tuple[int, int, int, int], min_side: int,
+                 clip: Optional[Tuple[int, int, int, int]]) -> None:
+        """Initialize a layout of <tree> in <rect> that has not been
+        refined at all.
+        """
+        self._tree = tree
+        self._version = tree._version
+        self._rect = rect
+        self._min_side = min_side
+        self._clip = clip
+        self._squarified = tree.squarified
+        self._chunks = []
+        self._nodes = []
+        self._frontier = deque()
+        self._expanded = []
+
+        drawn_as = self._classify(tree, rect)
+        if drawn_as is not None:
+            self._chunks.append((rect, tree.colour))
+            self._nodes.append(tree)
+            if drawn_as:
+                self._frontier.append((tree, rect, 0, self._chunks,
+                                       self._nodes, 0))
+        self._count = len(self._chunks)
+
+    def _matches(self: LayoutToken, tree: AbstractTree,
+                 rect: Tuple[int, int, int, int], min_side: int,
+                 clip: Optional[Tuple[int, int, int, int]]) -> bool:
+        """Return True iff this is a layout of <tree>, unchanged since it
+        started, in <rect> with <min_side>, <clip> and the layout mode of
+        <tree>.
+        """
+        return self._tree is tree and self._version == tree._version \
+            and self._rect == rect and self._min_side == min_side \
+            and self._clip == clip and self._squarified == tree.squarified
+
+    def _classify(self: LayoutToken, tree: AbstractTree,
+                  rect: Tuple[int, int, int, int]) -> Optional[bool]:
+        """Return None if <tree> is not drawn in <rect> in this layout,
+        False if it is drawn as one rectangle and True if it is subdivided
+        once the layout is complete.
+        """
+        if tree._root is None or tree.data_size == 0:
+            return None
+        culled = self._min_side > 0 and min(rect[2], rect[3]) < self._min_side
+        if culled and (rect[2] <= 0 or rect[3] <= 0):
+            return None
+        if self._clip is not None and not rects_overlap(rect, self._clip):
+            return None
+        return not culled and bool(tree._subtrees)
+
+
+class HitIndex:
+    """A uniform grid of the rectangles of a treemap, for finding the leaf
+    at a point without laying out the whole tree.
+
+    Only subtrees at least HIT_MIN_SIDE pixels wide and high are subdivided
+    when the grid is built. A point inside a smaller subtree is found by
+    laying out just the path down to it.
+
+    The grid only covers the part of the treemap inside a clip rectangle, so
+    its size is bounded by the screen however far the treemap is zoomed in.
+    A point outside the grid is found by laying out the path down to it.
+
+    === Private Attributes ===
+    _tree: the tree whose treemap is indexed.
+    _version: the version of <_tree> when the grid was built.
+    _rect: the rectangle <_tree> is laid out in.
+    _clip: the clip rectangle the index was built for, or None.
+    _area: the part of <_rect> inside <_clip>, which the grid covers.
+    _squarified: the layout mode of <_tree> when the grid was built.
+    _columns: the number of columns of cells.
+    _cells: for each cell, row by row, the (rectangle, tree) of every leaf
+        or small subtree whose rectangle overlaps the cell.
+    """
+    _tree: AbstractTree
+    _version: int
+    _rect: Tuple[int, int, int, int]
+    _clip: Optional[Tuple[int, int, int, int]]
+    _area: Tuple[int, int, int, int]
+    _squarified: bool
+    _columns: int
+    _cells: List[List[Tuple[Tuple[int, int, int, int], AbstractTree]]]
+
+    def __init__(self: HitIndex, tree: AbstractTree,
+                 rect: Tuple[int, int, int, int],
+                 clip: Optional[Tuple[int, int, int, int]] = None) -> None:
+        """Initialize an index of the part of the treemap of <tree> in <rect>
+        that is inside <clip>, or all of it if <clip> is None.
+        """
+        self._tree = tree
+        self._version = tree._version
+        self._rect = rect
+        self._clip = clip
+        self._squarified = tree.squarified
+
+        area = rect
+        if clip is not None:
+            left, top = max(rect[0], clip[0]), max(rect[1], clip[1])
+            area = (left, top,
+                    max(min(rect[0] + rect[2], clip[0] + clip[2]) - left, 0),
+                    max(min(rect[1] + rect[3], clip[1] + clip[3]) - top, 0))
+        self._area = area
+        self._columns = max(-(-area[2] // HIT_CELL), 0)
+        rows = max(-(-area[3] // HIT_CELL), 0)
+        self._cells = [[] for _ in range(self._columns * rows)]
+        if not self._cells:
+            return
+
+        # Rectangles may stick out of <area>, so only the cells they overlap
+        # within it are filled.
+        x, y = area[0], area[1]
+        for r, _, subtree in tree._iter_clipped(rect, HIT_MIN_SIDE, area,
+                                                self._squarified):
+            entry = (r, subtree)
+            left = max((r[0] - x) // HIT_CELL, 0)
+            right = min((r[0] + r[2] - 1 - x) // HIT_CELL, self._columns - 1)
+            for row in range(max((r[1] - y) // HIT_CELL, 0),
+                             min((r[1] + r[3] - 1 - y) // HIT_CELL + 1,
+                                 rows)):
+                start = row * self._columns
+                for cell in range(start + left, start + right + 1):
+                    self._cells[cell].append(entry)
+
+    def _matches(self: HitIndex, tree: AbstractTree,
+                 rect: Tuple[int, int, int, int],
+                 clip: Optional[Tuple[int, int, int, int]]) -> bool:
+        """Return True iff this is an index of <tree>, unchanged since it was
+        built, in <rect> and <clip> with the layout mode of <tree>.
+        """
+        return self._tree is tree and self._version == tree._version \
+            and self._rect == rect and self._clip == clip \
+            and self._squarified == tree.squarified
+
+    def find(self: HitIndex, coordinates: Tuple[int, int]) \
+            -> Optional[AbstractTree]:
+        """Return the leaf whose rectangle contains <coordinates>, or None if
+        there is none.
+        """
+        x, y = coordinates
+        if not coordinates_in_range(self._rect, coordinates):
+            return None
+
+        area = self._area
+        if not coordinates_in_range(area, coordinates):
+            for _, _, leaf in self._tree._iter_clipped(
+                    self._rect, 0, (x, y, 1, 1), self._squarified):
+                return leaf
+            return None
+
+        cell = (y - area[1]) // HIT_CELL * self._columns \
+            + (x - area[0]) // HIT_CELL
+        for r, subtree in self._cells[cell]:
+            if coordinates_in_range(r, coordinates):
+                for _, _, leaf in subtree._iter_clipped(
+                        r, 0, (x, y, 1, 1), self._squarified):
+                    return leaf
+                return None
+        return None
+
+
+def slice_layout(rect: Tuple[int, int, int, int], sizes: List[int],
+                 total: int) -> List[Tuple[int, int, int, int]]:
+    """ Return the rectangle of each item when <rect> is sliced between items
+
+    with the given <sizes>, whose sum is <total>.
+
+    <rect> is sliced along its longer side (vertically when it is square).
+    Each item gets the floor of its share of that side, and the last item
+    with a positive size gets whatever is left, so the items exactly fill
+    <rect>. The offsets are a running sum of the shares, so this is a single
+    pass over <sizes>.
+
+    Precondition: total > 0.
+    """
+    horizontal = rect[2] > rect[3]
+    if horizontal:
+        origin, length = rect[0], rect[2]
+    else:
+        origin, length = rect[1], rect[3]
+
+    last = len(sizes) - 1
+    while last > 0 and sizes[last] == 0:
+        last -= 1
+
+    rects = []
+    start = origin
+    for i in range(len(sizes)):
+        share = math.floor(sizes[i] / total * length)
+        extent = share if i < last else origin + length - start
+
+        if horizontal:
+            rects.append((start, rect[1], extent, rect[3]))
+        else:
+            rects.append((rect[0], start, rect[2], extent))
+        start += share
+
+    return rects
+
+
+def squarify_layout(rect: Tuple[int, int, int, int], sizes: List[int],
+                    total: int, order: Optional[List[int]] = None,
+                    rows: Optional[List[Tuple[int, bool]]] = None) \
+        -> List[Tuple[int, int, int, int]]:
+    """ Return the rectangle of each item when <rect> is divided between
+
+    items with the given <sizes>, whose sum is <total>, so that the
+    rectangles are as close to square as the squarified treemap algorithm
+    makes them.
+
+    The items are placed largest first, in rows along the shorter side of
+    the part of <rect> that is left. <order> is the indices of the items
+    from largest to smallest, and <rows> is squarify_rows of the sizes in
+    that order; both are computed if they are not given. Each row, and
+    then each item within it, gets the floor of its share of the space
+    that is left, and the last gets the rest, so the items exactly fill
+    <rect>. Items of size 0 get an empty rectangle.
+
+    Precondition: total > 0.
+    """
+    if order is None:
+        order = sorted(range(len(sizes)), key=sizes.__getitem__,
+                       reverse=True)
+    if rows is None:
+        rows = squarify_rows(rect[2], rect[3], [sizes[i] for i in order])
+
+    rects = [(rect[0], rect[1], 0, 0)] * len(sizes)
+    x, y, width, height = rect
+    remaining = total
+    start = 0
+    last_row = len(rows) - 1
+    for number, (count, column) in enumerate(rows):
+        row = order[start:start + count]
+        start += count
+        row_total = sum(map(sizes.__getitem__, row))
+
+        if column:
+            thickness = row_total * width // remaining \
+                if number < last_row else width
+            offset, length = y, height
+        else:
+            thickness = row_total * height // remaining \
+                if number < last_row else height
+            offset, length = x, width
+        remaining -= row_total
+
+        # Slice the row between its items along its length.
+        end = offset + length
+        for i in row[:-1]:
+            share = sizes[i] * length // row_total
+            if column:
+                rects[i] = (x, offset, thickness, share)
+            else:
+                rects[i] = (offset, y, share, thickness)
+            offset += share
+        if column:
+            rects[row[-1]] = (x, offset, thickness, end - offset)
+            x += thickness
+            width -= thickness
+        else:
+            rects[row[-1]] = (offset, y, end - offset, thickness)
+            y += thickness
+            height -= thickness
+
+    return rects
+
+
+def squarify_rows(width: float, height: float,
+                  sizes: List[int]) -> List[Tuple[int, bool]]:
+    """ Return how the squarified treemap algorithm splits items with the
+
+    given <sizes>, largest first, into rows in a <width> by <height>
+    rectangle: the number of items in each row, and whether the row is a
+    column down the left of what is left of the rectangle rather than a
+    row along its top. Items of size 0 are left out.
+
+    Items are added to a row for as long as that does not make its least
+    square item less square. Only the ratio of <width> to <height> matters.
+    """
+    count = 0
+    while count < len(sizes) and sizes[count] > 0:
+        count += 1
+    if count == 0:
+        return []
+
+    scale = width * height / sum(sizes[:count])
+    rows = []
+    i = 0
+    while i < count:
+        column = width >= height
+        side = height if column else width
+        if side <= 0:
+            rows.append((count - i, column))
+            break
+
+        # The worst aspect ratio in a row is that of its largest or its
+        # smallest item.
+        square = side * side
+        row_area = largest = sizes[i] * scale
+        worst = max(square / largest, largest / square)
+        j = i + 1
+        while j < count:
+            area = sizes[j] * scale
+            total = row_area + area
+            wide = square * largest / (total * total)
+            long = total * total / (square * area)
+            aspect = wide if wide > long else long
+            if aspect > worst:
+                break
+            row_area = total
+            worst = aspect
+            j += 1
+
+        rows.append((j - i, column))
+        if column:
+            width -= row_area / side
+        else:
+            height -= row_area / side
+        i = j
+
+    return rows
+
+
+def _flatten_chunks(chunks: List) \
+        -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+    """Return the (rectangle, colour) pairs in the nested lists <chunks> in
+    order.
+    """
+    rectangles = []
+    append = rectangles.append
+    stack = [iter(chunks)]
+    while stack:
+        for item in stack[-1]:
+            if type(item) is list:
+                stack.append(iter(item))
+                break
+            append(item)
+        else:
+            stack.pop()
+    return rectangles
+
+
+def _iter_chunks(chunks: List, nodes: List) \
+        -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int],
+                          AbstractTree]]:
+    """Yield the (rectangle, colour) pairs in the nested lists <chunks> in
+    order, each with the tree at the same place in <nodes>.
+    """
+    stack = [zip(chunks, nodes)]
+    while stack:
+        for item, node in stack[-1]:
+            if type(item) is list:
+                stack.append(zip(item, node))
+                break
+            yield item[0], item[1], node
+        else:
+            stack.pop()
+
+
 def path_to_node(tree: AbstractTree, lst: List[str]) -> str:
     """ Takes a list of nodes in a file system and returns the corresponding
      path
@@ -679,8 +1509,19 @@ def coordinates_in_range(pos1: Tuple[int, int, int, int],
     """ Return True iff pos2 is in the range of pos1 False otherwise.
 
     """
-    return pos2[0] in range(pos1[0], pos1[2] + pos1[0]) and \
-        pos2[1] in range(pos1[1], pos1[3] + pos1[1])
+    return pos1[0] <= pos2[0] < pos1[0] + pos1[2] and \
+        pos1[1] <= pos2[1] < pos1[1] + pos1[3]
+
+
+def rects_overlap(pos1: Tuple[int, int, int, int],
+                  pos2: Tuple[int, int, int, int]) -> bool:
+    """ Return True iff the rectangles pos1 and pos2 share at least one
+
+    pixel. A rectangle with no area shares no pixels with anything.
+    """
+    return pos1[2] > 0 and pos1[3] > 0 and pos2[2] > 0 and pos2[3] > 0 \
+        and pos1[0] < pos2[0] + pos2[2] and pos2[0] < pos1[0] + pos1[2] \
+        and pos1[1] < pos2[1] + pos2[3] and pos2[1] < pos1[1] + pos1[3]
 
 
 if __name__ == '__main__':
@@ -688,5 +1529,6 @@ if __name__ == '__main__':
 
     python_ta.check_all(
         config={
-            'extra-imports': ['os', 'random', 'math'],
+            'extra-imports': ['os', 'random', 'math', 'time',
+                              'collections'],
             'generated-members': 'pygame.*'})
@@ -1,7 +1,14 @@
+import time
+from queue import Queue, Empty
+from typing import Optional, Tuple
+
 import pygame
-from tree_data import FileSystemTree, AbstractTree
+from tree_data import AbstractTree, LayoutToken
 
 from population import PopulationTree
+from scanner import scan_file_system, scan_with_snapshot, scan_lazy, \
+    scan_streaming, ScanRules, SizeSampler, refine_estimates
+from watcher import TreeWatcher
 
 # Screen dimensions and coordinates
 
@@ -14,41 +21,80 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# The minimum number of seconds between redraws caused by background updates.
+REFRESH_INTERVAL = 0.1
+
+# Subtrees drawn narrower than this many pixels are filled with one colour
+# instead of being subdivided further.
+MIN_SIDE = 2
+
+# How much one step of the mouse wheel zooms in or out, and the furthest the
+# treemap can be zoomed in.
+ZOOM_STEP = 1.25
+MAX_ZOOM = 1 << 16
+
+# The number of seconds a frame may spend subdividing the treemap. Whatever
+# is left is refined over the following frames while there are no events.
+FRAME_SECONDS = 0.05
+
 
-def run_visualisation(tree: AbstractTree) -> None:
-    """Display an interactive graphical display of the given tree's treemap."""
+def run_visualisation(tree: AbstractTree,
+                      updates: Optional[Queue] = None) -> None:
+    """Display an interactive graphical display of the given tree's treemap.
+
+    If <updates> is given, it is a queue of changes to the tree made by
+    another thread; see event_loop.
+    """
     # Setup pygame
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
-    # Render the initial display of the static treemap.
-    render_display(screen, tree, '')
-
-    # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    # Start an event loop to respond to events. It renders the initial
+    # display of the treemap.
+    event_loop(screen, tree, updates)
 
 
 def render_display(screen: pygame.Surface, tree: AbstractTree,
-                   text: str) -> None:
+                   text: str,
+                   view: Optional[Tuple[int, int, int, int]] = None,
+                   token: Optional[LayoutToken] = None) \
+        -> Optional[LayoutToken]:
     """Render a treemap and text display to the given screen.
 
     Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
     screen vertically into the treemap and text comments.
+
+    <view> is the rectangle the whole tree is laid out in, which is larger
+    than the treemap area when zoomed in; see zoom_view. Only the subtrees
+    that are on screen are laid out.
+
+    The treemap is only subdivided for FRAME_SECONDS. Return a token to
+    pass back in as <token> to render it in more detail, or None if it is
+    complete.
     """
+    area = (ORIGIN[0], ORIGIN[1], WIDTH, TREEMAP_HEIGHT)
+    if view is None:
+        view = area
+    clip = None if view == area else area
 
     # First, clear the screen
     pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
                      (0, 0, WIDTH, HEIGHT))
 
-    all_data = tree.generate_treemap(
-        (ORIGIN[0], ORIGIN[1], WIDTH, TREEMAP_HEIGHT))
+    # Build any lazily scanned folders that are now big enough to subdivide.
+    tree.expand_visible(view, clip=clip)
 
-    for item in all_data:
-        screen.fill(item[1], item[0])
+    rectangles, token = tree.generate_treemap_lod(
+        view, MIN_SIDE, clip, seconds=FRAME_SECONDS, token=token)
+    screen.set_clip(area)
+    for r, colour in rectangles:
+        screen.fill(colour, r)
+    screen.set_clip(None)
 
     _render_text(screen, text)
 
     pygame.display.flip()
+    return token
 
 
 def _render_text(screen: pygame.Surface, text: str) -> None:
@@ -62,13 +108,27 @@ def _render_text(screen: pygame.Surface, text: str) -> None:
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: AbstractTree) -> None:
+def event_loop(screen: pygame.Surface, tree: AbstractTree,
+               updates: Optional[Queue] = None) -> None:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends when the user closes the window.
+
+    If <updates> is given, it holds callables that change the tree, put there
+    by a background producer such as scan_streaming. They are run here, in
+    order, so the tree is only ever touched by this thread, and the display
+    is redrawn at most every REFRESH_INTERVAL seconds while they arrive.
+
+    The mouse wheel zooms in and out around the pointer, and dragging with
+    the middle button pans the zoomed in treemap. The S key switches between
+    the slice-and-dice and squarified layouts, except for a CompactTree,
+    which only has the slice-and-dice layout.
+
+    Each frame is laid out within FRAME_SECONDS, and refined in later frames
+    for as long as no events are waiting.
     """
     # We strongly recommend using a variable to keep track of the currently-
     # selected leaf (type AbstractTree | None).
@@ -77,9 +137,24 @@ def event_loop(screen: pygame.Surface, tree: AbstractTree) -> None:
 
     selected_leaf = None
     t = ''
+    area = (ORIGIN[0], ORIGIN[1], WIDTH, TREEMAP_HEIGHT)
+    view = area
+    refining = render_display(screen, tree, t, view)
+    last_render = time.monotonic()
+    stale = False
 
     while True:
 
+        if updates is not None:
+            stale = _apply_updates(updates) or stale
+            if stale and time.monotonic() - last_render >= REFRESH_INTERVAL:
+                refining = render_display(screen, tree, t, view, refining)
+                last_render = time.monotonic()
+                stale = False
+
+        if refining is not None and not pygame.event.peek():
+            refining = render_display(screen, tree, t, view, refining)
+
         # Wait for an event
         event = pygame.event.poll()
 
@@ -87,63 +162,166 @@ def event_loop(screen: pygame.Surface, tree: AbstractTree) -> None:
             pygame.quit()
             return
 
-        if event.type == pygame.MOUSEBUTTONUP and (
-                event.pos[0] in range(ORIGIN[0], WIDTH + 1)
-                and event.pos[1] in range(ORIGIN[1], TREEMAP_HEIGHT + 1)):
-
-            if event.button == 1 and isinstance(tree.coordinate_to_tree(
-                    event.pos,
-                    (ORIGIN[0],
-                     ORIGIN[1],
-                     WIDTH,
-                     TREEMAP_HEIGHT)), AbstractTree):
-                selected_leaf, t = left_click_helper(selected_leaf, tree,
-                                                     event.pos)
-                render_display(screen, tree, t)
-
-            if event.button == 3 and selected_leaf != tree.coordinate_to_tree(
-                    event.pos, (ORIGIN[0],
-                                ORIGIN[1],
-                                WIDTH,
-                                TREEMAP_HEIGHT)):
-                tree.mouse_right(event.pos, (ORIGIN[0], ORIGIN[1], WIDTH,
-                                             TREEMAP_HEIGHT))
-                render_display(screen, tree, t)
-
-            elif event.button == 3 and selected_leaf == tree.coordinate_to_tree(
-                    event.pos, (ORIGIN[0],
-                                ORIGIN[1],
-                                WIDTH,
-                                TREEMAP_HEIGHT)):
-                tree.mouse_right(event.pos, (ORIGIN[0], ORIGIN[1], WIDTH,
-                                             TREEMAP_HEIGHT))
-                t = ''
-                render_display(screen, tree, t)
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button in (4, 5):
+            view = zoom_view(view, event.pos, ZOOM_STEP if event.button == 4
+                             else 1 / ZOOM_STEP)
+            refining = render_display(screen, tree, t, view, refining)
+
+        if event.type == pygame.MOUSEMOTION and event.buttons[1]:
+            view = pan_view(view, event.rel)
+            refining = render_display(screen, tree, t, view, refining)
+
+        if event.type == pygame.MOUSEBUTTONUP and event.button in (1, 3) \
+                and ORIGIN[0] <= event.pos[0] <= WIDTH \
+                and ORIGIN[1] <= event.pos[1] <= TREEMAP_HEIGHT:
+            hit = tree.coordinate_to_tree(event.pos, view, area)
+
+            if event.button == 1 and hit is not None:
+                selected_leaf, t = left_click_helper(selected_leaf, hit)
+                refining = render_display(screen, tree, t, view, refining)
+
+            if event.button == 3:
+                if selected_leaf == hit:
+                    t = ''
+                tree.mouse_right(event.pos, view, area)
+                refining = render_display(screen, tree, t, view, refining)
+
+        if event.type == pygame.KEYUP and event.key == pygame.K_s \
+                and isinstance(tree, AbstractTree):
+            tree.squarified = not tree.squarified
+            refining = render_display(screen, tree, t, view, refining)
 
         if event.type == pygame.KEYUP and t != '':
             if event.key == 273:
                 size = selected_leaf.increase_decrease(True)
                 selected_leaf.increase_decrease_parent(size, True)
                 t = selected_leaf.path()
-                render_display(screen, tree, t)
+                refining = render_display(screen, tree, t, view, refining)
 
             if event.key == 274:
                 size = selected_leaf.increase_decrease(False)
                 selected_leaf.increase_decrease_parent(size, False)
                 t = selected_leaf.path()
-                render_display(screen, tree, t)
+                refining = render_display(screen, tree, t, view, refining)
 
         # Remember to call render_display if any data_sizes change,
         # as the treemap will change in this case.
 
 
-def run_treemap_file_system(path: str) -> None:
+def zoom_view(view: Tuple[int, int, int, int], position: Tuple[int, int],
+              factor: float) -> Tuple[int, int, int, int]:
+    """Return <view> zoomed in by <factor>, or out if it is less than 1,
+    keeping the point at <position> where it is on screen.
+
+    A view is never smaller than the treemap area, or more than MAX_ZOOM
+    times larger, and always covers it.
+    """
+    width = min(max(round(view[2] * factor), WIDTH), WIDTH * MAX_ZOOM)
+    height = min(max(round(view[3] * factor), TREEMAP_HEIGHT),
+                 TREEMAP_HEIGHT * MAX_ZOOM)
+    x = position[0] - (position[0] - view[0]) * width // view[2]
+    y = position[1] - (position[1] - view[1]) * height // view[3]
+    return _clamp_view((x, y, width, height))
+
+
+def pan_view(view: Tuple[int, int, int, int],
+             offset: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Return <view> moved by <offset>, as far as it can go while still
+    covering the treemap area.
+    """
+    return _clamp_view((view[0] + offset[0], view[1] + offset[1], view[2],
+                        view[3]))
+
+
+def _clamp_view(view: Tuple[int, int, int, int]) \
+        -> Tuple[int, int, int, int]:
+    """Return <view> moved the least it can be to cover the treemap area."""
+    x = min(max(view[0], ORIGIN[0] + WIDTH - view[2]), ORIGIN[0])
+    y = min(max(view[1], ORIGIN[1] + TREEMAP_HEIGHT - view[3]), ORIGIN[1])
+    return x, y, view[2], view[3]
+
+
+def _apply_updates(updates: Queue) -> bool:
+    """Run the callables waiting in <updates>, for at most REFRESH_INTERVAL
+    seconds so the window stays responsive.
+
+    Return True iff any were run.
+    """
+    applied = False
+    deadline = time.monotonic() + REFRESH_INTERVAL
+
+    while time.monotonic() < deadline:
+        try:
+            update = updates.get_nowait()
+        except Empty:
+            break
+        update()
+        applied = True
+
+    return applied
+
+
+def run_treemap_file_system(path: str,
+                            snapshot_path: Optional[str] = None,
+                            lazy: bool = False, stream: bool = False,
+                            watch: bool = False,
+                            rules: Optional[ScanRules] = None,
+                            sample_above: Optional[int] = None,
+                            min_size: int = 0,
+                            max_children: Optional[int] = None) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
+    If <snapshot_path> is given, the scan is saved there and the next run
+    only lists the directories that changed since. Otherwise, if <lazy> is
+    True, folders are only built once they are big enough on screen to be
+    subdivided, and if <stream> is True, the treemap is drawn straight away
+    and refined while the scan runs.
+
+    If <watch> is True, changes on disk are applied to the treemap as they
+    happen. The watcher needs every node of a full scan from the start, so
+    raise ValueError if <watch> is combined with <stream>, <lazy>,
+    <sample_above>, <min_size> or <max_children>.
+
+    <rules> decides which files and folders are left out of a full or
+    streaming scan; see ScanRules.
+
+    If <sample_above> is given, a full scan only samples the sizes of the
+    files of folders with more files than that, and the estimates are made
+    exact in the background while the treemap is shown.
+
+    If <min_size> or <max_children> is given, a full scan merges the small
+    items of each folder into one leaf, which is split again when it is big
+    enough on screen; see scan_file_system.
+
     Precondition: <path> is a valid path to a file or folder.
     """
-    file_tree = FileSystemTree(path)
-    run_visualisation(file_tree)
+    if watch and (stream or lazy or sample_above is not None
+                  or min_size > 0 or max_children is not None):
+        raise ValueError('watch cannot be combined with stream, lazy, '
+                         'sample_above, min_size or max_children')
+
+    updates = None
+    if snapshot_path is not None:
+        file_tree = scan_with_snapshot(path, snapshot_path)
+    elif stream:
+        updates = Queue()
+        file_tree = scan_streaming(path, updates, rules=rules)
+    elif lazy:
+        file_tree = scan_lazy(path)
+    elif sample_above is not None:
+        updates = Queue()
+        file_tree = scan_file_system(
+            path, min_size=min_size, max_children=max_children, rules=rules,
+            sampler=SizeSampler(sample_above, min(1000, sample_above)))
+        refine_estimates(file_tree, updates, path, rules)
+    else:
+        file_tree = scan_file_system(path, min_size=min_size,
+                                     max_children=max_children, rules=rules)
+
+    if watch:
+        updates = Queue()
+        TreeWatcher(file_tree, path, updates, rules=rules).start()
+    run_visualisation(file_tree, updates)
 
 
 def run_treemap_population() -> None:
@@ -152,26 +330,19 @@ def run_treemap_population() -> None:
     run_visualisation(pop_tree)
 
 
-def left_click_helper(selected_leaf: AbstractTree, tree: AbstractTree,
-                      position: tuple) -> tuple:
+def left_click_helper(selected_leaf: AbstractTree,
+                      hit: AbstractTree) -> tuple:
     """ Returns a two element tuple with a selected leaf and specific
 
-    text for a screen depending on selected_leaf and rectangle.
+    text for a screen depending on selected_leaf and <hit>, the leaf that
+    was clicked.
     """
-    if selected_leaf == tree.coordinate_to_tree(position,
-                                                (ORIGIN[0],
-                                                 ORIGIN[1],
-                                                 WIDTH,
-                                                 TREEMAP_HEIGHT)):
+    if selected_leaf == hit:
         t = ''
         selected_leaf = None
         return selected_leaf, t
 
-    selected_leaf = tree.coordinate_to_tree(position,
-                                            (ORIGIN[0],
-                                             ORIGIN[1],
-                                             WIDTH,
-                                             TREEMAP_HEIGHT))
+    selected_leaf = hit
 
     t = selected_leaf.path()
 
@@ -183,7 +354,8 @@ if __name__ == '__main__':
 
     python_ta.check_all(
         config={
-            'extra-imports': ['pygame', 'tree_data', 'population'],
+            'extra-imports': ['pygame', 'tree_data', 'population',
+                              'scanner', 'watcher'],
             'generated-members': 'pygame.*'})
 
     # To check your work for Tasks 1-4, try uncommenting the following function
@@ -0,0 +1,402 @@
+"""Keep a FileSystemTree up to date as the files it was scanned from change.
+
+On Linux, a TreeWatcher subscribes to inotify events for every folder of
+the tree. Elsewhere, or if inotify runs out of watches, it falls back to
+polling the folders' modification times. Either way, each change is turned
+into a callable on an update queue that event_loop runs, and that touches
+only the changed node and its ancestors.
+"""
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from functools import partial
+from queue import Queue
+
+from stat import S_ISDIR
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tree_data import AbstractTree, FileSystemTree
+from scanner import scan_file_system, walk, build_tree, _visitor, \
+    Listing, ScanRules
+
+# inotify event masks, from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+    | IN_CREATE | IN_DELETE
+
+# The fixed part of a struct inotify_event: wd, mask, cookie, len.
+_EVENT = struct.Struct('iIII')
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except (OSError, TypeError):
+    _LIBC = None
+
+
+class TreeWatcher:
+    """Watches the files and folders a FileSystemTree was scanned from.
+
+    Changes are published to an update queue as callables, which must be
+    run in order on the thread that owns the tree; see event_loop.
+
+    The tree must be a full scan, with no lazy folders or coalesced items:
+    nodes built later are not known to the watcher, and the files inside a
+    CoalescedItems leaf have no nodes to update.
+
+    === Private Attributes ===
+    _tree: the tree being kept up to date.
+    _path: the full path the tree was scanned from.
+    _updates: the queue changes are published to.
+    _interval: the number of seconds between polls, if polling.
+    _rules: the rules the tree was scanned with, or None. Files and folders
+        they leave out are not added, and folders they prune are neither
+        watched nor listed.
+    _list: the function that lists a folder of the tree under <_rules>.
+    _nodes: every node of the tree by full path. Only touched by the
+        callables on the update queue.
+    _stopped: set when the watcher should stop.
+    """
+    _tree: FileSystemTree
+    _path: str
+    _updates: Queue
+    _interval: float
+    _rules: Optional[ScanRules]
+    _list: Callable[[str], Tuple[Listing, List[str]]]
+    _nodes: Dict[str, AbstractTree]
+    _stopped: threading.Event
+
+    def __init__(self: TreeWatcher, tree: FileSystemTree, path: str,
+                 updates: Queue, interval: float = 2.0,
+                 rules: Optional[ScanRules] = None) -> None:
+        """Initialize a watcher for <tree>, which was scanned from <path>
+        following <rules>.
+
+        <interval> is only used if the watcher has to poll.
+        """
+        self._tree = tree
+        self._path = path
+        self._updates = updates
+        self._interval = interval
+        self._rules = rules
+        self._list = _visitor(path, rules, None)
+        self._nodes = {}
+        self._stopped = threading.Event()
+        self._index(path, tree)
+
+    def start(self: TreeWatcher) -> None:
+        """Start watching on a background thread."""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self: TreeWatcher) -> None:
+        """Stop watching. Updates already queued are still valid."""
+        self._stopped.set()
+
+    def _run(self: TreeWatcher) -> None:
+        """Watch with inotify if possible, or poll otherwise."""
+        fd = _inotify_init()
+        if fd is not None:
+            try:
+                if self._watch(fd):
+                    return
+            finally:
+                os.close(fd)
+        self._poll()
+
+    # Producer side, on the background thread.
+
+    def _watch(self: TreeWatcher, fd: int) -> bool:
+        """Publish the changes reported by the inotify instance <fd> until
+        stopped.
+
+        Return False if the folders could not all be watched, in which case
+        the caller should poll instead.
+        """
+        paths = {}
+        if not _add_watches(fd, self._path, paths, self._list):
+            return False
+
+        while not self._stopped.is_set():
+            ready, _, _ = select.select([fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            modified = []
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self._publish_rescan()
+                elif wd in paths and name:
+                    path = os.path.join(paths[wd], os.fsdecode(name))
+                    if not self._handle(fd, paths, path, mask, modified):
+                        self._publish_modified(modified)
+                        return False
+            self._publish_modified(modified)
+        return True
+
+    def _handle(self: TreeWatcher, fd: int, paths: Dict[int, str],
+                path: str, mask: int, modified: List[str]) -> bool:
+        """Publish the change described by the inotify event <mask> for
+        <path>, keeping the watches in <paths> in step. A modified file is
+        appended to <modified> instead, to be published with the others.
+
+        Return False if a new folder could not be watched.
+        """
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            if mask & IN_ISDIR:
+                _remove_watches(fd, path, paths)
+            self._publish(partial(self._deleted, path))
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            entry = self._listed(path)
+            if entry is None:
+                return True
+            if entry[1] and not _add_watches(fd, path, paths, self._list):
+                return False
+            self._publish_created(path, entry)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE):
+            modified.append(path)
+        return True
+
+    def _poll(self: TreeWatcher) -> None:
+        """Publish the files and folders that are created or deleted,
+        checking every folder's modification time every <_interval> seconds,
+        until stopped.
+
+        A file modified in place is only noticed when its folder changes.
+        """
+        known = self._poll_state()
+        while not self._stopped.wait(self._interval):
+            current = self._poll_state(known)
+            modified = {}
+            for directory in current:
+                if directory not in known:
+                    continue
+                old, new = known[directory][1], current[directory][1]
+                for name in old:
+                    if name not in new:
+                        self._publish(partial(
+                            self._deleted, os.path.join(directory, name)))
+                for name in new:
+                    path = os.path.join(directory, name)
+                    if name not in old or new[name][0] != old[name][0]:
+                        self._publish_created(path, (name,) + new[name])
+                    elif new[name] != old[name] and not new[name][0]:
+                        modified[path] = new[name][1]
+            if modified:
+                self._publish(partial(self._modified, modified))
+            known = current
+
+    def _poll_state(self: TreeWatcher,
+                    known: Optional[Dict[str, Tuple[int, Dict]]] = None) \
+            -> Dict[str, Tuple[int, Dict[str, Tuple[bool, int]]]]:
+        """Return the modification time and entries of every folder below
+        <_path>, listing only the folders whose modification time differs
+        from <known>. Folders are listed under <_rules>, so a pruned folder
+        is an entry that is not a folder, sized as the rules size it.
+        """
+        state = {}
+        stack = [self._path]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                if known is not None and directory in known \
+                        and known[directory][0] == mtime:
+                    entries = known[directory][1]
+                else:
+                    listing, _ = self._list(directory)
+                    entries = {name: (is_dir, size)
+                               for name, is_dir, size in listing}
+            except OSError:
+                continue
+            state[directory] = (mtime, entries)
+            stack.extend(os.path.join(directory, name)
+                         for name, (is_dir, _) in entries.items() if is_dir)
+        return state
+
+    def _publish(self: TreeWatcher, update: partial) -> None:
+        """Put <update> on the update queue."""
+        self._updates.put(update)
+
+    def _listed(self: TreeWatcher, path: str) \
+            -> Optional[Tuple[str, bool, int]]:
+        """Return the entry for <path> that listing its folder gives, or
+        None if <path> is gone or left out by <_rules>.
+        """
+        name = os.path.basename(path)
+        if self._rules is None:
+            try:
+                mode = os.stat(path).st_mode
+            except OSError:
+                return None
+            return name, S_ISDIR(mode), 0
+        try:
+            listing, _ = self._list(os.path.dirname(path))
+        except OSError:
+            return None
+        for entry in listing:
+            if entry[0] == name:
+                return entry
+        return None
+
+    def _publish_created(self: TreeWatcher, path: str,
+                         entry: Tuple[str, bool, int]) -> None:
+        """Scan the new file or folder at <path>, whose <entry> was listed
+        under <_rules>, and publish it.
+        """
+        name, is_dir, size = entry
+        try:
+            if is_dir:
+                subtree = build_tree(path, dict(walk(path, self._list, 1)))
+            elif self._rules is None:
+                subtree = scan_file_system(path, 1)
+            else:
+                subtree = FileSystemTree(None, name, [], size)
+        except OSError:
+            return
+        self._publish(partial(self._created, path, subtree))
+
+    def _publish_modified(self: TreeWatcher, paths: List[str]) -> None:
+        """Publish the new sizes of the files at <paths> as one update, so
+        their folders' sizes are only changed once.
+        """
+        sizes = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not S_ISDIR(stat.st_mode):
+                sizes[path] = stat.st_size
+        if sizes:
+            self._publish(partial(self._modified, sizes))
+
+    def _publish_rescan(self: TreeWatcher) -> None:
+        """Publish a fresh scan of the whole tree, after events were lost."""
+        try:
+            tree = scan_file_system(self._path, rules=self._rules)
+        except OSError:
+            return
+        self._publish(partial(self._replaced, tree))
+
+    # Consumer side, on the thread that owns the tree.
+
+    def _index(self: TreeWatcher, path: str, tree: AbstractTree) -> None:
+        """Record <tree>, found at <path>, and every node below it."""
+        stack = [(path, tree)]
+        while stack:
+            path, node = stack.pop()
+            self._nodes[path] = node
+            for subtree in node._subtrees:
+                if not subtree.is_empty():
+                    stack.append((os.path.join(path, subtree._root), subtree))
+
+    def _deleted(self: TreeWatcher, path: str) -> None:
+        """Remove the node for <path> from the tree, if it is there."""
+        node = self._nodes.get(path)
+        if node is None or node._parent_tree is None:
+            return
+
+        stack = [(path, node)]
+        while stack:
+            path, removed = stack.pop()
+            self._nodes.pop(path, None)
+            for subtree in removed._subtrees:
+                if not subtree.is_empty():
+                    stack.append((os.path.join(path, subtree._root),
+                                  subtree))
+
+        # Deleted from its folder only, which is left even if it is empty.
+        node._parent_tree.delete_node(node)
+
+    def _created(self: TreeWatcher, path: str, subtree: AbstractTree) -> None:
+        """Add <subtree>, scanned from <path>, to the tree, replacing any
+        node that is already there.
+        """
+        folder = self._nodes.get(os.path.dirname(path))
+        if folder is None:
+            return
+        self._deleted(path)
+        folder.add_subtrees([subtree])
+        self._index(path, subtree)
+
+    def _modified(self: TreeWatcher, sizes: Dict[str, int]) -> None:
+        """Set the size of the file at each path in <sizes> to its value."""
+        deltas = {}
+        for path, size in sizes.items():
+            node = self._nodes.get(path)
+            if node is not None and not node._subtrees:
+                deltas[node] = size - node.data_size
+        self._tree.apply_size_deltas(deltas)
+
+    def _replaced(self: TreeWatcher, tree: AbstractTree) -> None:
+        """Make the watched tree match <tree>, a fresh scan of it."""
+        self._tree.replace_subtrees(tree._subtrees)
+        self._nodes = {}
+        self._index(self._path, self._tree)
+
+
+def _inotify_init() -> Optional[int]:
+    """Return a new non-blocking inotify file descriptor, or None if inotify
+    is not available.
+    """
+    if _LIBC is None or not hasattr(_LIBC, 'inotify_init1'):
+        return None
+    fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    return fd if fd >= 0 else None
+
+
+def _add_watches(fd: int, path: str, paths: Dict[int, str],
+                 visit: Callable[[str], Tuple[Listing, List[str]]]) -> bool:
+    """Watch the folder <path> and every folder below it with the inotify
+    instance <fd>, recording each watch in <paths>. Folders are listed with
+    <visit>, so folders it prunes are not watched.
+
+    Return False if the system ran out of watches.
+    """
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        wd = _LIBC.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            if ctypes.get_errno() == errno.ENOSPC:
+                return False
+            continue
+        paths[wd] = directory
+        try:
+            _, subdirs = visit(directory)
+        except OSError:
+            continue
+        stack.extend(subdirs)
+    return True
+
+
+def _remove_watches(fd: int, path: str, paths: Dict[int, str]) -> None:
+    """Stop watching the folder <path> and every folder below it."""
+    prefix = path + os.sep
+    for wd in [wd for wd in paths
+               if paths[wd] == path or paths[wd].startswith(prefix)]:
+        _LIBC.inotify_rm_watch(fd, wd)
+        del paths[wd]